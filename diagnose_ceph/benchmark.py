@@ -0,0 +1,384 @@
+import hashlib
+import json
+import multiprocessing
+import optparse
+import os
+import resource
+import sys
+import threading
+import time
+
+from replay import ReplaySFTP, ReplayTransport
+from troubleshoot_ceph import TroubleshootCeph
+from troubleshoot_ceph_mon import TroubleshootCephMon
+from troubleshoot_ceph_osd import TroubleshootCephOsd
+
+
+class SyntheticCluster(object):
+    """ Generated ceph cluster whose hosts are answered by a ReplayTransport.
+
+        Mons live on hosts of their own, osds are packed osds_per_host to a
+        host. Every host is reachable over ssh by its ip and as a juju
+        machine, mons being machines 0..mons-1.
+
+        Args:
+            mons (int): number of mons.
+            osds (int): number of osds.
+            osds_per_host (int): osds on every osd host.
+            down (iterable): ids of the osds that are down.
+            stale (iterable): names of the mons holding an outdated monmap,
+                until one is injected.
+            clocks (dict): host name -> seconds its clock is off.
+            cut (iterable): names of the mons the network separates from
+                the others.
+    """
+
+    def __init__(self, mons, osds, osds_per_host=12, down=(), stale=(),
+                 clocks=None, cut=()):
+        self.down = set(down)
+        self.stale = set(stale)
+        self.clocks = clocks or {}
+        self.cut = set(cut)
+        self.replay = None
+        self.mons = [('mon-%d' % i, '10.0.0.%d' % (i + 1))
+                     for i in range(mons)]
+        hosts = (osds + osds_per_host - 1) // osds_per_host
+        self.osd_hosts = [('osd-host-%d' % i,
+                           '10.1.%d.%d' % (i // 250, i % 250 + 1))
+                          for i in range(hosts)]
+        self.osds = [(i, self.osd_hosts[i // osds_per_host][0])
+                     for i in range(osds)]
+        self.hostnames = dict((ip, name) for name, ip
+                              in self.mons + self.osd_hosts)
+        self.machines = dict((str(i), ip) for i, (name, ip)
+                             in enumerate(self.mons + self.osd_hosts))
+
+    @property
+    def leader(self):
+        return self.mons[0][1]
+
+    def transport(self, latency=None, default_latency=0):
+        responders = [
+            (r'printf \'\{"init_type"', self._host_facts),
+            (r'--admin-daemon \S+ mon_status', self._mon_status),
+            (r'ceph health detail --format json', self._health),
+            (r'ceph health$', self._health_plain),
+            (r'ceph mon_status --format json', self._mon_status),
+            (r'ceph osd ls', '\n'.join(str(i) for i, h in self.osds) + '\n'),
+            (r'ceph osd tree --format=json', self._osd_tree()),
+            (r'ceph osd find (\d+)', self._osd_find),
+            (r'ceph osd stat --format json', self._osd_stat),
+            (r'ceph osd dump --format json', self._osd_dump),
+            (r'ceph quorum_status --format json', self._quorum_status),
+            (r'pidof ceph-mon', '1234\n'),
+            (r'systemctl (start|stop) ceph-mon', ''),
+            (r'ceph-mon -i \S+ --extract-monmap', ''),
+            (r'ceph-mon -i \S+ --inject-monmap', self._inject_monmap),
+            (r'^md5sum /tmp/monmap$', self._md5sum),
+            (r'^date \+%s\.%N$', self._date),
+            (r'^ntpdate -q (\S+)$', self._ntpdate),
+            (r'^for a in (.+?); do \(', self._port_probe),
+            (r'^juju scp (\d+):(\S+) (\S+)$', self._juju_scp_get),
+            (r'^juju scp (\S+) (\d+):(\S+)$', self._juju_scp_put),
+            (r'ceph -w', ''),
+            (r'^juju status --format json\b', self._juju_status),
+            (r'^juju --version$', '2.0.2-xenial-amd64\n'),
+        ]
+        conf = '[global]\nmon host = %s\n' % ' '.join(
+            ip + ':6789' for name, ip in self.mons)
+        files = {'/etc/ceph/ceph.conf': conf,
+                 '/tmp/monmap': json.dumps(self._monmap())}
+        self.replay = ReplayTransport(responders, files, latency,
+                                      default_latency, self.machines)
+        return self.replay
+
+    def _host_facts(self, host, match):
+        name = self.hostnames.get(host, host)
+        if name.startswith('mon-'):
+            sockets = ['ceph-mon.' + name + '.asok']
+        else:
+            sockets = ['ceph-osd.%d.asok' % i for i, h in self.osds
+                       if h == name]
+        return json.dumps({'init_type': 'systemd', 'arch_type': '64bit',
+                           'hostname': name, 'internal_ip': host,
+                           'sockets': sockets})
+
+    def _monmap(self, stale=False):
+        # a stale map is the one before the last mon was added
+        mons = self.mons[:-1] if stale else self.mons
+        return {'epoch': 1 if stale else 2,
+                'mons': [{'name': name, 'rank': rank, 'addr': ip + ':6789/0'}
+                         for rank, (name, ip) in enumerate(mons)]}
+
+    def _mon_status(self, host, match):
+        name = self.hostnames.get(host, self.mons[0][0])
+        state = 'leader' if name == self.mons[0][0] else 'peon'
+        return json.dumps({'name': name, 'state': state,
+                           'quorum': range(len(self.mons)),
+                           'monmap': self._monmap(name in self.stale)})
+
+    def _inject_monmap(self, host, match):
+        uploaded = self.replay.uploads.get((host, '/tmp/monmap'))
+        if uploaded is None:
+            return '', 'error: /tmp/monmap does not exist', 1
+        if json.loads(uploaded) == self._monmap():
+            self.stale.discard(self.hostnames.get(host))
+        return ''
+
+    def _md5sum(self, host, match):
+        uploaded = self.replay.uploads.get((host, '/tmp/monmap'))
+        if uploaded is None:
+            return '', 'md5sum: /tmp/monmap: No such file', 1
+        return hashlib.md5(uploaded).hexdigest() + '  /tmp/monmap\n'
+
+    def _date(self, host, match):
+        offset = self.clocks.get(self.hostnames.get(host), 0)
+        return '%.9f\n' % (time.time() + offset)
+
+    def _ntpdate(self, host, match):
+        server = match.group(1)
+        offset = (self.clocks.get(self.hostnames.get(server), 0) -
+                  self.clocks.get(self.hostnames.get(host), 0))
+        return 'server %s, stratum 2, offset %.6f, delay 0.00050\n' % (
+            server, offset)
+
+    def _port_probe(self, host, match):
+        source = self.hostnames.get(host) in self.cut
+        lines = []
+        for endpoint in match.group(1).split():
+            target = self.hostnames.get(endpoint.split(':')[0]) in self.cut
+            lines.append(endpoint + (' down' if source != target
+                                     else ' up 350'))
+        return '\n'.join(lines) + '\n'
+
+    def _juju_scp_get(self, host, match):
+        ReplaySFTP(self.replay, self.machines[match.group(1)]).get(
+            match.group(2), match.group(3))
+        return ''
+
+    def _juju_scp_put(self, host, match):
+        ReplaySFTP(self.replay, self.machines[match.group(2)]).put(
+            match.group(1), match.group(3))
+        return ''
+
+    def _quorum_status(self, host, match):
+        return json.dumps({'quorum': range(len(self.mons)),
+                           'quorum_names': [n for n, ip in self.mons]})
+
+    def _health(self, host, match):
+        if not self.down:
+            return json.dumps({'status': 'HEALTH_OK', 'checks': {}})
+        detail = [{'message': 'osd.%d is down' % i}
+                  for i in sorted(self.down)]
+        return json.dumps({'status': 'HEALTH_WARN', 'checks': {
+            'OSD_DOWN': {'severity': 'HEALTH_WARN', 'detail': detail,
+                         'summary': {'message': '%d osds down' %
+                                     len(self.down)}}}})
+
+    def _health_plain(self, host, match):
+        return ('HEALTH_WARN' if self.down else 'HEALTH_OK') + '\n'
+
+    def _osd_tree(self):
+        nodes = [{'id': -1, 'name': 'default', 'type': 'root',
+                  'children': [-(i + 2) for i in range(len(self.osd_hosts))]}]
+        for index, (name, ip) in enumerate(self.osd_hosts):
+            nodes.append({'id': -(index + 2), 'name': name, 'type': 'host',
+                          'children': [i for i, h in self.osds if h == name]})
+        for i, host in self.osds:
+            nodes.append({'id': i, 'name': 'osd.%d' % i, 'type': 'osd',
+                          'status': 'down' if i in self.down else 'up',
+                          'reweight': 1.0})
+        return json.dumps({'nodes': nodes, 'stray': []})
+
+    def _osd_find(self, host, match):
+        osd_host = dict(self.osds)[int(match.group(1))]
+        return json.dumps({'osd': int(match.group(1)),
+                           'crush_location': {'host': osd_host,
+                                              'root': 'default'}})
+
+    def _osd_stat(self, host, match):
+        total = len(self.osds)
+        return json.dumps({'num_osds': total,
+                           'num_up_osds': total - len(self.down),
+                           'num_in_osds': total})
+
+    def _osd_dump(self, host, match):
+        return json.dumps({'osds': [{'osd': i, 'up': int(i not in self.down),
+                                     'in': 1} for i, h in self.osds]})
+
+    def _juju_status(self, host, match):
+        def units(name, hosts, first):
+            return dict(('%s/%d' % (name, i),
+                         {'machine': str(first + i), 'public-address': ip})
+                        for i, (hostname, ip) in enumerate(hosts))
+        return json.dumps({'services': {
+            'ceph': {'units': units('ceph', self.mons, 0)},
+            'ceph-osd': {'units': units('ceph-osd', self.osd_hosts,
+                                        len(self.mons))}}})
+
+
+def _rss_kb():
+    ''' Current resident set size, None where /proc is not available '''
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize() // 1024
+
+
+class RssSampler(threading.Thread):
+    """ Samples the resident set size while a phase runs.
+
+        ru_maxrss only ever grows over the life of the process, so it can
+        not tell the peak of one phase from the peak of an earlier one.
+
+        Args:
+            interval (float): seconds between two samples.
+    """
+
+    def __init__(self, interval=0.005):
+        super(RssSampler, self).__init__()
+        self.daemon = True
+        self.interval = interval
+        self.start_kb = self.peak_kb = _rss_kb()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak_kb = max(self.peak_kb, _rss_kb())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak_kb = max(self.peak_kb, _rss_kb())
+
+
+def _run_phase(name, func, transport):
+    calls, connections = transport.calls, transport.connections
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sampler = None
+    if _rss_kb() is not None:
+        sampler = RssSampler()
+        sampler.start()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    start = time.time()
+    try:
+        func()
+    finally:
+        elapsed = time.time() - start
+        sys.stdout.close()
+        sys.stdout = stdout
+        if sampler is not None:
+            sampler.stop()
+    if sampler is not None:
+        peak, growth = sampler.peak_kb, sampler.peak_kb - sampler.start_kb
+    else:
+        # only growth past the earlier peak shows without /proc
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        growth = peak - maxrss
+    return {'phase': name, 'time': elapsed,
+            'calls': transport.calls - calls,
+            'connections': transport.connections - connections,
+            'peak_rss_kb': peak, 'rss_growth_kb': growth}
+
+
+def run_diagnosis(cluster, latency=None, default_latency=0, extra_args=()):
+    '''
+        Run the read only diagnosis phases against a SyntheticCluster over
+        ssh, extra_args are appended to the diagnose_ceph command line.
+
+        Returns:
+            list: a dict per phase with wall time, remote calls, ssh
+                connections opened, the peak rss during the phase and how
+                far it rose above the rss the phase started at.
+    '''
+    transport = cluster.transport(latency, default_latency)
+    args = ['-H', cluster.leader, '-u', 'bench', '-p', 'bench']
+    args += list(extra_args)
+    state = {}
+
+    def mon_objects():
+        state['mons'] = TroubleshootCephMon(True)._get_machine_objects()
+
+    phases = [
+        ('discovery', lambda: TroubleshootCeph(args)),
+        ('health', lambda: TroubleshootCeph.get_health_report(
+            TroubleshootCeph.connection, refresh=True)),
+        ('mon objects', mon_objects),
+        ('monmaps', lambda: TroubleshootCephMon(True)._get_monmap_holders(
+            state['mons'])),
+        ('osd objects',
+         lambda: TroubleshootCephOsd(args)._get_all_osd_object()),
+    ]
+    TroubleshootCeph.reset_session()
+    TroubleshootCeph.transport = transport
+    try:
+        return [_run_phase(name, func, transport) for name, func in phases]
+    finally:
+        TroubleshootCeph.tracer.close()
+        TroubleshootCeph.reset_session()
+        TroubleshootCeph.transport = None
+
+
+def _get_opt_parser():
+    desc = ('Time the diagnosis phases against generated clusters answered '
+            'offline, to catch regressions in remote round trips.')
+    parser = optparse.OptionParser(description=desc)
+    parser.add_option('--mons', dest='mons', default='3,5,7',
+                      help='comma separated mon counts')
+    parser.add_option('--osds', dest='osds', default='10,100,1000,5000',
+                      help='comma separated osd counts')
+    parser.add_option('--osds-per-host', dest='osds_per_host', type='int',
+                      default=12)
+    parser.add_option('--latency', dest='latency', type='float', default=0,
+                      help='seconds every remote command takes')
+    parser.add_option('-o', '--output', dest='output', default=None,
+                      help='write the results as JSON to this file')
+    parser.add_option('--trace', dest='trace', default=None,
+                      help='append the spans of every run to this file')
+    return parser
+
+
+def _benchmark(job):
+    ''' Run one cluster, in a fresh process so its memory is its own '''
+    mons, osds, options = job
+    cluster = SyntheticCluster(mons, osds, options['osds_per_host'])
+    extra_args = [] if options['trace'] is None else \
+        ['--trace', options['trace']]
+    phases = run_diagnosis(cluster, default_latency=options['latency'],
+                           extra_args=extra_args)
+    for phase in phases:
+        phase.update(mons=mons, osds=osds)
+    return phases
+
+
+def run():
+    options, arguments = _get_opt_parser().parse_args()
+    jobs = [(mons, osds, vars(options))
+            for mons in [int(n) for n in options.mons.split(',')]
+            for osds in [int(n) for n in options.osds.split(',')]]
+    results = []
+    print '%5s %6s  %-12s %9s %7s %6s %12s %12s' % (
+        'mons', 'osds', 'phase', 'time', 'calls', 'conns', 'peak rss kb',
+        'rss growth')
+    # one cluster at a time, each in a process of its own
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        for phases in pool.imap(_benchmark, jobs):
+            for phase in phases:
+                results.append(phase)
+                print ('%(mons)5d %(osds)6d  %(phase)-12s %(time)8.3fs '
+                       '%(calls)7d %(connections)6d %(peak_rss_kb)12d '
+                       '%(rss_growth_kb)12d' % phase)
+    finally:
+        pool.close()
+        pool.join()
+    if options.output is not None:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    run()
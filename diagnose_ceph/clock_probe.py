@@ -0,0 +1,150 @@
+import re
+
+from helpers.exceptions import TimeoutError
+
+# a server line of ntpdate -q
+_NTPDATE = re.compile(r'stratum (\d+), offset (-?[\d.]+), delay ([\d.]+)')
+
+
+class ClockSample(object):
+    """ Clock of a mon host against a reference clock.
+
+        Args:
+            mon: the MonObject sampled.
+            offset (float): seconds the host clock is ahead(negative when
+                behind) of the reference, the machine running the tool or
+                over juju the first mon.
+            uncertainty (float): half the round trip of the sample, the
+                offset is exact within +/- that many seconds.
+            skew (float): offset from the median offset of all mons, what
+                ceph compares against mon_clock_drift_allowed.
+    """
+    __slots__ = ('mon', 'offset', 'uncertainty', 'skew')
+
+    def __init__(self, mon, offset, uncertainty, skew=0.0):
+        self.mon = mon
+        self.offset = offset
+        self.uncertainty = uncertainty
+        self.skew = skew
+
+    def skewed(self, allowed):
+        ''' True when the skew surely exceeds allowed seconds '''
+        return abs(self.skew) - self.uncertainty > allowed
+
+
+class ClockProbe(object):
+    """ Measures the clock offset of every mon host at once.
+
+        Every host is asked for its time in the same round of concurrent
+        commands. A reading taken while the command was in flight lies
+        between its start and end, so the offset is measured against the
+        midpoint and half the round trip bounds the error. Each host is
+        sampled several times, one round after the other so its samples
+        never queue behind each other, the tightest round trip wins. Skew
+        is taken against the median of the mons, so a wrong local clock
+        does not make every mon look skewed.
+
+        Over juju every command is a juju run taking seconds, far too long a
+        round trip to see any skew. There the hosts query the ntp server of
+        the first mon themselves, all in one juju run, falling back to round
+        trips when a mon gets no answer.
+
+        Args:
+            troubleshooter: TroubleshootCeph class or instance whose gather
+                runs the commands.
+            samples (int): readings taken per host.
+    """
+    COMMAND = 'date +%s.%N'
+    QUERY = 'ntpdate -q '
+
+    def __init__(self, troubleshooter, samples=3):
+        self.troubleshooter = troubleshooter
+        self.samples = max(1, int(samples))
+
+    def measure(self, mons):
+        '''
+            Returns:
+                list: ClockSample of every mon that answered, the most
+                    skewed first.
+        '''
+        mons = [mon for mon in mons if mon.connection is not None]
+        best = None
+        if mons and self.troubleshooter.is_juju is True:
+            best = self._query_reference(mons)
+        if best is None:
+            best = self._round_trips(mons)
+        offsets = sorted(sample.offset for sample in best.values())
+        if offsets:
+            middle = len(offsets) // 2
+            median = (offsets[middle] + offsets[~middle]) / 2
+            for sample in best.values():
+                sample.skew = sample.offset - median
+        return sorted(best.values(), key=lambda sample: abs(sample.skew),
+                      reverse=True)
+
+    def _round_trips(self, mons):
+        '''
+            mon -> ClockSample of the tightest round trip. Every round asks
+            all hosts at once, a host is only asked again once it answered
+            so its samples do not queue up behind each other.
+        '''
+        jobs = [(mon.connection, self.COMMAND) for mon in mons]
+        best = {}
+        for i in range(self.samples):
+            results = self.troubleshooter.gather(
+                jobs, self.troubleshooter.COMMAND_TIMEOUT)
+            for mon, result in zip(mons, results):
+                if not result.ok or result.started is None:
+                    continue
+                try:
+                    remote = float(result.stdout.strip())
+                except ValueError:
+                    continue
+                uncertainty = result.duration / 2
+                sample = ClockSample(mon, remote - (result.started +
+                                                    uncertainty), uncertainty)
+                if mon not in best or uncertainty < best[mon].uncertainty:
+                    best[mon] = sample
+        return best
+
+    def _query_reference(self, mons):
+        '''
+            mon -> ClockSample against the ntp server of the first mon,
+            None unless every mon got an answer from it.
+        '''
+        ts = self.troubleshooter
+        command = self.QUERY + mons[0].host
+        try:
+            results = ts._execute_juju_batch(mons, command,
+                                             ts.COMMAND_TIMEOUT)
+        except TimeoutError:
+            return None
+        best = {}
+        for mon in mons:
+            out, err, status = results[mon]
+            for stratum, offset, delay in _NTPDATE.findall(out):
+                if 0 < int(stratum) < 16:
+                    # ntpdate reports the correction, the reference - host
+                    best[mon] = ClockSample(mon, -float(offset),
+                                            float(delay) / 2)
+                    break
+            else:
+                return None
+        return best
+
+    @staticmethod
+    def report(samples, allowed):
+        print '%-20s %10s %10s %10s' % ('mon', 'skew', 'offset', '+/-')
+        for sample in samples:
+            print '%-20s %9.3fs %9.3fs %9.3fs%s' % (
+                sample.mon.mon_id, sample.skew, sample.offset,
+                sample.uncertainty,
+                ' skewed' if sample.skewed(allowed) else '')
+        vague = [sample for sample in samples
+                 if sample.uncertainty > allowed]
+        if vague:
+            print 'Clock of', ', '.join(str(sample.mon.mon_id)
+                                        for sample in vague),
+            print 'known only within +/-%.3fs, a skew over the allowed' \
+                % max(sample.uncertainty for sample in vague),
+            print '%.3fs may go unnoticed' % allowed
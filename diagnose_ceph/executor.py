@@ -0,0 +1,247 @@
+import os
+import select
+import time
+
+from helpers.deadline import kill, spawn
+
+
+class CommandResult(object):
+    """ Outcome of a remote command, whatever transport ran it.
+
+        Args:
+            target: connection the command ran on (paramiko client or juju
+                machine object).
+            command (str): the command.
+            stdout (str): standard output.
+            stderr (str): standard error, or why the command could not run.
+            exit_status (int): exit status, None when it never finished.
+            duration (float): seconds from start to completion.
+            started (float): epoch seconds the command started at.
+    """
+    __slots__ = ('target', 'command', 'stdout', 'stderr', 'exit_status',
+                 'duration', 'started')
+
+    def __init__(self, target, command, stdout, stderr, exit_status,
+                 duration, started=None):
+        self.target = target
+        self.command = command
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exit_status = exit_status
+        self.duration = duration
+        self.started = started
+
+    @property
+    def ok(self):
+        return self.exit_status == 0
+
+
+class CommandStream(object):
+    """ Output of a command, to be read as it arrives.
+
+        Meant for a with block, close() finishes the command(ex waits for
+        the local process and checks how it ended) and raises when it
+        failed.
+
+        Args:
+            stream: file the output is read from.
+            finish (callable): finish(bytes_read), called once by close().
+    """
+
+    def __init__(self, stream, finish=None):
+        self.stream = stream
+        self.finish = finish
+        self.bytes = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes += len(data)
+        return data
+
+    def close(self):
+        finish, self.finish = self.finish, None
+        if finish is not None:
+            finish(self.bytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _Job(object):
+    ''' A command in flight, fed by RemoteExecutor's select loop '''
+
+    def __init__(self, index, target, command, seconds):
+        self.index = index
+        self.target = target
+        self.command = command
+        self.started = time.time()
+        self.expires = None if seconds is None else self.started + seconds
+        self.out = []
+        self.err = []
+
+    def expired(self):
+        return self.expires is not None and time.time() >= self.expires
+
+    def result(self, exit_status, error=None):
+        stderr = ''.join(self.err) + ('' if error is None else error)
+        return CommandResult(self.target, self.command, ''.join(self.out),
+                             stderr, exit_status, time.time() - self.started,
+                             self.started)
+
+
+class _SSHJob(_Job):
+    def start(self):
+        self.channel = self.target.get_transport().open_session()
+        self.channel.exec_command(self.command)
+        self.channel.setblocking(0)
+
+    def fds(self):
+        return [self.channel]
+
+    def pump(self):
+        while self.channel.recv_ready():
+            self.out.append(self.channel.recv(32768))
+        while self.channel.recv_stderr_ready():
+            self.err.append(self.channel.recv_stderr(32768))
+
+    def done(self):
+        return (self.channel.exit_status_ready() and
+                (self.channel.eof_received or self.channel.closed) and
+                not self.channel.recv_ready() and
+                not self.channel.recv_stderr_ready())
+
+    def finish(self):
+        self.channel.close()
+        return self.result(self.channel.recv_exit_status())
+
+    def abort(self, error):
+        self.channel.close()
+        return self.result(None, error)
+
+
+class _LocalJob(_Job):
+    ''' A local process, used for juju run '''
+
+    def __init__(self, index, target, command, seconds, shell_cmd,
+                 spawn_local=spawn):
+        super(_LocalJob, self).__init__(index, target, command, seconds)
+        self.shell_cmd = shell_cmd
+        self.spawn_local = spawn_local
+
+    def start(self):
+        self.proc = self.spawn_local(self.shell_cmd)
+        self.open = {self.proc.stdout.fileno(): self.out,
+                     self.proc.stderr.fileno(): self.err}
+
+    def fds(self):
+        return list(self.open)
+
+    def pump(self, readable=()):
+        for fd in readable:
+            if fd in self.open:
+                data = os.read(fd, 32768)
+                if data:
+                    self.open[fd].append(data)
+                else:
+                    del self.open[fd]
+
+    def done(self):
+        return not self.open
+
+    def finish(self):
+        return self.result(self.proc.wait())
+
+    def abort(self, error):
+        kill(self.proc)
+        try:
+            self.proc.wait()
+        except OSError:
+            pass
+        return self.result(None, error)
+
+
+class RemoteExecutor(object):
+    """ Runs many remote commands at once from a single select() loop.
+
+        Over ssh each command gets its own non-blocking channel on the
+        target's (pooled) transport, over juju each command is a `juju run`
+        subprocess whose pipes are read as data arrives. At most `limit`
+        commands are in flight, the rest wait for a free slot.
+
+        Args:
+            juju_run_cmd (callable): juju_run_cmd(target, command) returns
+                the local shell command running command on a juju target.
+            limit (int): max commands in flight.
+            spawn_local (callable): spawn_local(shell_cmd) starts a local
+                command, returning a subprocess.Popen alike.
+    """
+    TICK = 0.2
+
+    def __init__(self, juju_run_cmd, limit=16, spawn_local=spawn):
+        self.juju_run_cmd = juju_run_cmd
+        self.limit = max(1, int(limit))
+        self.spawn_local = spawn_local
+
+    def gather(self, jobs, is_juju, seconds=None):
+        '''
+            Run every (target, command) of jobs, each bounded by seconds.
+            Returns CommandResult objects in the order of jobs.
+        '''
+        pending = list(enumerate(jobs))
+        running = []
+        results = [None] * len(pending)
+
+        while pending or running:
+            while pending and len(running) < self.limit:
+                index, (target, command) = pending.pop(0)
+                job = self._start(index, target, command, is_juju, seconds)
+                if isinstance(job, CommandResult):
+                    results[index] = job
+                else:
+                    running.append(job)
+            if not running:
+                continue
+
+            readable = self._wait(running)
+            for job in list(running):
+                if isinstance(job, _LocalJob):
+                    job.pump(readable)
+                else:
+                    job.pump()
+                if job.done():
+                    results[job.index] = job.finish()
+                elif job.expired():
+                    results[job.index] = job.abort('timed out')
+                else:
+                    continue
+                running.remove(job)
+        return results
+
+    def _start(self, index, target, command, is_juju, seconds):
+        if is_juju:
+            job = _LocalJob(index, target, command, seconds,
+                            self.juju_run_cmd(target, command),
+                            self.spawn_local)
+        else:
+            job = _SSHJob(index, target, command, seconds)
+        try:
+            job.start()
+        except Exception as err:
+            return job.result(None, str(err))
+        return job
+
+    def _wait(self, running):
+        fds = []
+        for job in running:
+            fds.extend(job.fds())
+        timeout = self.TICK
+        expiring = [job.expires for job in running if job.expires]
+        if expiring:
+            timeout = max(0, min(timeout, min(expiring) - time.time()))
+        if not fds:
+            time.sleep(timeout)
+            return []
+        return select.select(fds, [], [], timeout)[0]
@@ -0,0 +1,132 @@
+import json
+import multiprocessing
+import optparse
+import os
+import sys
+import time
+
+from helpers.helpers import MyStr
+from mon_status import MonStatus
+from status_watcher import osd_stat_status
+from troubleshoot_ceph import TroubleshootCeph
+
+
+def _get_opt_parser():
+    desc = ('Read only health sweep over many ceph clusters. The clusters '
+            'file is a JSON list of objects with a name and either '
+            'host/user/password/ssh_key for ssh or provider "juju" and the '
+            'juju model to use.')
+    parser = optparse.OptionParser(description=desc)
+    parser.add_option('-c', '--clusters', dest='clusters', default=None,
+                      help='JSON file listing the clusters')
+    parser.add_option('-j', '--jobs', dest='jobs', type='int', default=4,
+                      help='clusters diagnosed in parallel')
+    parser.add_option('-t', '--timeout', dest='timeout', default=30)
+    parser.add_option('-o', '--output', dest='output', default=None,
+                      help='write the merged report as JSON to this file')
+    return parser
+
+
+def _cluster_args(cluster, timeout):
+    ''' Command line of the single cluster tool for a clusters file entry '''
+    args = ['-P', cluster.get('provider', 'ssh'), '-t', str(timeout)]
+    for key, flag in [('host', '-H'), ('user', '-u'), ('password', '-p'),
+                      ('ssh_key', '-k')]:
+        if cluster.get(key) is not None:
+            args += [flag, cluster[key]]
+    return args
+
+
+def _run_read_only(connection, command):
+    out, err = TroubleshootCeph._execute_command(
+        connection, command, is_juju=TroubleshootCeph.is_juju,
+        seconds=TroubleshootCeph.COMMAND_TIMEOUT)
+    TroubleshootCeph._get_eof(out, command)
+    return MyStr(out).read()
+
+
+def diagnose_cluster(cluster, timeout=30):
+    '''
+        Read only diagnosis of one cluster, run in its own worker process so
+        the class level session state of TroubleshootCeph is never shared.
+    '''
+    start = time.time()
+    report = {'name': cluster.get('name'), 'status': None, 'checks': {},
+              'quorum': None, 'out_of_quorum': None, 'osd_status': None,
+              'discovery_time': None, 'error': None}
+    if cluster.get('model'):
+        os.environ['JUJU_MODEL'] = os.environ['JUJU_ENV'] = cluster['model']
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        TroubleshootCeph.reset_session()
+        TroubleshootCeph(_cluster_args(cluster, timeout))
+        report['discovery_time'] = time.time() - start
+        connection = TroubleshootCeph.connection
+
+        health = TroubleshootCeph.get_health_report(connection, refresh=True)
+        report['status'] = health.status
+        report['checks'] = dict((code, check.summary) for code, check
+                                in health.checks.iteritems())
+
+        mon_status = MonStatus.from_json(_run_read_only(connection,
+                                                        MonStatus.COMMAND))
+        report['quorum'] = mon_status.quorum_names
+        report['out_of_quorum'] = [mon.name for mon
+                                   in mon_status.out_of_quorum()]
+
+        report['osd_status'] = osd_stat_status(
+            _run_read_only(connection, 'sudo ceph osd stat --format json'))
+    except (Exception, SystemExit) as err:
+        report['error'] = '%s: %s' % (type(err).__name__, err)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        TroubleshootCeph.reset_session()
+    report['duration'] = time.time() - start
+    return report
+
+
+def _diagnose(job):
+    return diagnose_cluster(*job)
+
+
+def print_report(reports):
+    print '%-20s %-12s %-10s %-22s %8s  %s' % ('cluster', 'health', 'osds',
+                                               'out of quorum', 'time',
+                                               'checks / error')
+    for report in reports:
+        detail = report['error'] or ', '.join(sorted(report['checks']))
+        out_of_quorum = '-'
+        if report['out_of_quorum'] is not None:
+            out_of_quorum = ','.join(report['out_of_quorum']) or 'none'
+        print '%-20s %-12s %-10s %-22s %7.1fs  %s' % (
+            report['name'], report['status'] or '-',
+            report['osd_status'] or '-', out_of_quorum, report['duration'],
+            detail)
+
+
+def run():
+    parser = _get_opt_parser()
+    options, arguments = parser.parse_args()
+    if options.clusters is None:
+        parser.error('a clusters file is required')
+    with open(options.clusters, 'r') as f:
+        clusters = json.load(f)
+
+    start = time.time()
+    # a fresh process per cluster keeps every session isolated
+    pool = multiprocessing.Pool(max(1, options.jobs), maxtasksperchild=1)
+    try:
+        reports = pool.map(_diagnose, [(cluster, options.timeout)
+                                       for cluster in clusters])
+    finally:
+        pool.close()
+        pool.join()
+
+    print_report(reports)
+    print '\n%d clusters in %.1fs' % (len(reports), time.time() - start)
+    if options.output is not None:
+        with open(options.output, 'w') as f:
+            json.dump(reports, f, indent=2)
@@ -0,0 +1,114 @@
+import json
+import re
+
+# Summaries of pre-luminous `ceph health detail` carry no check codes, these
+# map their wording onto the luminous codes
+LEGACY_CODES = [
+    (re.compile(r'clock skew'), 'MON_CLOCK_SKEW'),
+    (re.compile(r'mons? down|out of quorum'), 'MON_DOWN'),
+    (re.compile(r'osds? (are )?down'), 'OSD_DOWN'),
+    (re.compile(r'near ?full'), 'OSD_NEARFULL'),
+    (re.compile(r'full osd'), 'OSD_FULL'),
+]
+
+
+class HealthCheck(object):
+    """ One failing health check of the cluster.
+
+        Args:
+            code (str): check code given by ceph(ex MON_CLOCK_SKEW).
+            severity (str): HEALTH_WARN or HEALTH_ERR.
+            summary (str): one line description.
+            detail (list): detail messages, one per affected daemon.
+    """
+
+    def __init__(self, code, severity, summary, detail):
+        self.code = code
+        self.severity = severity
+        self.summary = summary
+        self.detail = detail
+
+    def mons(self):
+        ''' Names of the mons this check is about (without mon. prefix) '''
+        return self._names(r'\bmon\.([^\s,;:]+)')
+
+    def osds(self):
+        ''' Ids of the osds this check is about '''
+        return [int(i) for i in self._names(r'\bosd\.(\d+)')]
+
+    def _names(self, pattern):
+        names = []
+        for text in [self.summary] + self.detail:
+            for name in re.findall(pattern, text):
+                if name not in names:
+                    names.append(name)
+        return names
+
+
+class HealthReport(object):
+    """ Parsed output of `ceph health detail --format json`.
+
+        Checks are indexed by code, so every troubleshooter can look up the
+        checks it handles without running the health command again.
+
+        Args:
+            status (str): overall status(HEALTH_OK/HEALTH_WARN/HEALTH_ERR).
+            checks (list): HealthCheck objects.
+    """
+    COMMAND = 'sudo ceph health detail --format json'
+
+    def __init__(self, status, checks):
+        self.status = status
+        self.checks = dict((check.code, check) for check in checks)
+
+    @classmethod
+    def from_json(cls, text):
+        health = json.loads(text)
+        if 'checks' in health:
+            checks = []
+            for code, check in health['checks'].iteritems():
+                detail = [d.get('message', '') for d in check.get('detail',
+                                                                  [])]
+                checks.append(HealthCheck(code, check.get('severity'),
+                                          check['summary']['message'],
+                                          detail))
+            return cls(health['status'], checks)
+        return cls._from_legacy(health)
+
+    @classmethod
+    def _from_legacy(cls, health):
+        checks = {}
+        detail = [d if isinstance(d, basestring) else d.get('message', '')
+                  for d in health.get('detail', [])]
+        for summary in health.get('summary', []):
+            text = summary.get('summary', '')
+            code = 'UNKNOWN'
+            for pattern, legacy_code in LEGACY_CODES:
+                if pattern.search(text):
+                    code = legacy_code
+                    break
+            if code in checks:
+                checks[code].summary += '; ' + text
+                continue
+            checks[code] = HealthCheck(code, summary.get('severity'), text,
+                                       [d for d in detail
+                                        if cls._matches(d, code)])
+        return cls(health.get('overall_status', health.get('status')),
+                   checks.values())
+
+    @staticmethod
+    def _matches(detail, code):
+        for pattern, legacy_code in LEGACY_CODES:
+            if legacy_code == code and pattern.search(detail):
+                return True
+        return False
+
+    def has(self, *codes):
+        return any(code in self.checks for code in codes)
+
+    def get(self, code):
+        return self.checks.get(code)
+
+    @property
+    def codes(self):
+        return sorted(self.checks)
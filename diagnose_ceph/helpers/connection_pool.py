@@ -0,0 +1,145 @@
+import threading
+import time
+
+
+class PooledClient(object):
+    """ Stable handle on the pooled ssh client of a host.
+
+        Callers keep the handle for the whole run(ex MonObject.connection),
+        every use goes through the pool, so a host whose client was evicted
+        or dropped is connected again instead of left unreachable.
+
+        Args:
+            pool (ConnectionPool): the pool the client lives in.
+            hostname (str): host the client is connected to.
+    """
+
+    def __init__(self, pool, hostname):
+        self._pool = pool
+        self.hostname = hostname
+
+    def exec_command(self, *args, **kwargs):
+        return self._pool.client(self.hostname).exec_command(*args, **kwargs)
+
+    def open_sftp(self):
+        return self._pool.client(self.hostname).open_sftp()
+
+    def get_transport(self):
+        return self._pool.client(self.hostname).get_transport()
+
+    def __getattr__(self, name):
+        return getattr(self._pool.client(self.hostname), name)
+
+
+class ConnectionPool(object):
+    """ Keeps one authenticated ssh client per host.
+
+        Every call to exec_command on a pooled client opens a new channel on
+        the same transport, so a host is only handshaked once no matter how
+        many commands are run on it.
+
+        Args:
+            connect (callable): connect(hostname) returning a connected
+                paramiko SSHClient.
+            max_connections (int): maximum number of hosts kept connected.
+                When the cap is reached the least recently used idle client
+                is closed, its host reconnects on the next use of its
+                PooledClient.
+    """
+
+    def __init__(self, connect, max_connections=64):
+        self._connect = connect
+        self.max_connections = max(1, int(max_connections))
+        self._clients = {}
+        self._handles = {}
+        self._last_used = {}
+        self._host_locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+
+    def get(self, hostname):
+        '''
+            Connect to hostname unless it already is, returns the
+            PooledClient of the host.
+        '''
+        self.client(hostname)
+        with self._lock:
+            return self._handles.setdefault(hostname,
+                                            PooledClient(self, hostname))
+
+    def client(self, hostname):
+        ''' The live ssh client of hostname, connecting when needed '''
+        with self._lock:
+            host_lock = self._host_locks.setdefault(hostname,
+                                                    threading.Lock())
+        # Only one thread handshakes with a given host at a time
+        with host_lock:
+            client = self._clients.get(hostname)
+            if client is not None and self._is_alive(client):
+                with self._lock:
+                    self.hits += 1
+                    self._last_used[hostname] = time.time()
+                return client
+
+            with self._lock:
+                self.misses += 1
+                if client is not None:
+                    self.reconnects += 1
+                    self._discard(hostname)
+
+            client = self._connect(hostname)
+
+            with self._lock:
+                self._clients[hostname] = client
+                self._last_used[hostname] = time.time()
+                self._evict(keep=hostname)
+            return client
+
+    def close_all(self):
+        with self._lock:
+            for hostname in list(self._clients):
+                self._discard(hostname)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'reconnects': self.reconnects,
+                'open': len(self._clients)}
+
+    def _is_alive(self, client):
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    def _busy(self, client):
+        ''' True while a command is still running on one of its channels '''
+        transport = client.get_transport()
+        # paramiko keeps the open channels of a transport in _channels
+        channels = getattr(transport, '_channels', None)
+        if channels is None:
+            return False
+        return any(not (channel.closed or channel.exit_status_ready())
+                   for channel in channels.values())
+
+    def _evict(self, keep):
+        candidates = [h for h in self._clients
+                      if h != keep and not self._busy(self._clients[h])]
+        candidates.sort(key=lambda h: self._last_used[h])
+        # busy clients are left alone, the cap is met once they are idle
+        while len(self._clients) > self.max_connections and candidates:
+            self._discard(candidates.pop(0))
+
+    def _discard(self, hostname):
+        client = self._clients.pop(hostname, None)
+        self._last_used.pop(hostname, None)
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                pass
@@ -0,0 +1,130 @@
+from contextlib import contextmanager
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from exceptions import TimeoutError
+
+_local = threading.local()
+
+
+class Deadline(object):
+    """ Point in time by which a remote command has to return.
+
+        Deadlines are plain objects, so they can be handed to worker threads
+        or stored alongside a pending command. The deadline of the innermost
+        timeout() scope of the current thread is found with
+        current_deadline().
+
+        Args:
+            seconds (float): time allowed from now.
+            command (str): command text used in the TimeoutError message.
+    """
+
+    def __init__(self, seconds, command=None):
+        self.expires = time.time() + float(seconds)
+        self.command = command
+
+    def remaining(self):
+        return max(0.0, self.expires - time.time())
+
+    def expired(self):
+        return time.time() >= self.expires
+
+    def error(self, command=None):
+        command = self.command if command is None else command
+        return TimeoutError("'%s' command did not return" % command)
+
+    def check(self, command=None):
+        if self.expired():
+            raise self.error(command)
+
+
+def current_deadline():
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def effective_deadline(seconds=None, command=None):
+    '''
+        Return the tighter of an explicit per call timeout and the deadline
+        of the enclosing timeout() scope, None if there is neither.
+    '''
+    outer = current_deadline()
+    if seconds is None:
+        return outer
+    own = Deadline(seconds, command)
+    if outer is not None and outer.expires < own.expires:
+        return outer
+    return own
+
+
+@contextmanager
+def deadline_scope(seconds, command=None):
+    ''' Deadline of seconds for the block, None keeps the current one '''
+    outer = current_deadline()
+    if seconds is None:
+        yield outer
+        return
+    deadline = Deadline(seconds, command)
+    # a nested scope never extends the deadline of its caller
+    if outer is not None and outer.expires < deadline.expires:
+        deadline = Deadline(outer.remaining(), command)
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(deadline)
+    try:
+        yield deadline
+    finally:
+        stack.pop()
+
+
+def spawn(cmd, stderr=subprocess.PIPE):
+    '''
+        Start cmd in a local shell, in a process group of its own so that
+        kill() reaches the command and not only the shell.
+    '''
+    return subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                            stderr=stderr, preexec_fn=os.setsid)
+
+
+def kill(proc):
+    '''
+        Kill the process group of a process started by spawn(), or a
+        stand-in for one(ex a replayed juju run).
+    '''
+    if not isinstance(proc, subprocess.Popen):
+        proc.kill()
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def communicate(proc, deadline=None, command=None):
+    '''
+        proc.communicate() bounded by deadline. The process is killed and
+        TimeoutError raised when it does not finish in time.
+    '''
+    if deadline is None:
+        return proc.communicate()
+    killed = []
+
+    def _kill():
+        killed.append(True)
+        kill(proc)
+
+    timer = threading.Timer(deadline.remaining(), _kill)
+    timer.daemon = True
+    timer.start()
+    try:
+        out, err = proc.communicate()
+    finally:
+        timer.cancel()
+    if killed:
+        raise deadline.error(command)
+    return out, err
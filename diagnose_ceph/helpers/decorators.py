@@ -1,27 +1,22 @@
-from functools import wraps, partial
-import signal
+from functools import wraps
 
-from exceptions import TimeoutError
+from deadline import deadline_scope
 
 
 def timeout(seconds=20):
+    '''
+        Run the decorated call inside a deadline scope of `seconds`.
 
-    def decorator(func):
-        def _handle_timeout(command, signum, frame):
-            raise TimeoutError("'%s' command did not return" % command)
+        Remote execution (_execute_command, _get_eof) honours the deadline of
+        the innermost scope of the calling thread, so unlike a SIGALRM based
+        timeout any number of threads can have their own deadline.
+    '''
 
+    def decorator(func):
         def wrapper(*args, **kwargs):
-            if len(args) >= 3:
-                signal.signal(signal.SIGALRM, partial(_handle_timeout,
-                                                      args[2]))
-            else:
-                signal.signal(signal.SIGALRM, partial(_handle_timeout, None))
-            signal.alarm(seconds)
-            try:
-                result = func(*args, **kwargs)
-            finally:
-                signal.alarm(0)
-            return result
+            command = args[2] if len(args) >= 3 else None
+            with deadline_scope(seconds, command):
+                return func(*args, **kwargs)
 
         return wraps(func)(wrapper)
 
@@ -0,0 +1,51 @@
+import json
+import os
+import time
+
+
+class DiscoveryCache(object):
+    """ JSON file remembering discovery results between runs.
+
+        Args:
+            path (str): location of the cache file.
+            ttl (int): seconds a saved entry stays valid, 0 disables the
+                cache altogether.
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = int(ttl)
+
+    def load(self):
+        ''' Return the saved entry, None when missing, stale or unreadable '''
+        if self.ttl <= 0:
+            return None
+        try:
+            with open(self.path, 'r') as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if time.time() - entry.get('created', 0) > self.ttl:
+            return None
+        return entry
+
+    def save(self, entry):
+        if self.ttl <= 0:
+            return
+        entry = dict(entry, created=time.time())
+        directory = os.path.dirname(self.path)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(entry, f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            print 'Could not write discovery cache ' + self.path
+
+    def invalidate(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -1,3 +1,6 @@
+from multiprocessing.pool import ThreadPool
+
+
 class MyStr(object):
     def __init__(self, obj):
         self.obj = obj
@@ -7,3 +10,19 @@ class MyStr(object):
             return self.obj
         else:
             return self.obj.read()
+
+
+def run_in_parallel(func, items, workers):
+    '''
+        Apply func to every item using at most `workers` threads.
+        Results are returned in the same order as items.
+    '''
+    items = list(items)
+    if not items:
+        return []
+    pool = ThreadPool(max(1, min(int(workers), len(items))))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,178 @@
+import json
+import re
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+_SCALAR = re.compile(r'[^,}\]\s]+')
+_STRUCTURE = re.compile(r'["{}\[\]]')
+
+
+class JsonStream(object):
+    """ Pulls selected parts out of a JSON document read from a stream.
+
+        Only the values found at the wanted path are ever decoded, every
+        other value is skipped over as it streams past, so memory use is
+        bounded by the largest wanted item rather than the document.
+
+        Args:
+            stream: anything with read(size), ex the stdout of a paramiko
+                exec_command or of a subprocess.
+            chunk_size (int): bytes read at a time.
+    """
+
+    def __init__(self, stream, chunk_size=65536):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def items(self, path):
+        '''
+            Yield (trail, item) for the items of every array or object found
+            at path. path is a list of the accepted keys at each level, ex
+            [('nodes',)] or [('applications', 'services'), ('ceph',),
+            ('units',)]. trail holds the keys matched, items of objects are
+            (key, value) pairs. Raises ValueError on malformed documents.
+        '''
+        if self._peek() != '{':
+            raise ValueError('expected a JSON object')
+        for found in self._walk(path, ()):
+            yield found
+
+    def _walk(self, path, trail):
+        ''' Walk the object at pos, consuming it '''
+        self.pos += 1
+        if self._peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self._string()
+            self._expect(':')
+            value_start = self._peek()
+            if key not in path[0]:
+                self._skip_value()
+            elif len(path) > 1 and value_start == '{':
+                for found in self._walk(path[1:], trail + (key,)):
+                    yield found
+            elif len(path) == 1 and value_start in '[{':
+                for item in self._members(value_start):
+                    yield trail + (key,), item
+            else:
+                self._skip_value()
+            if self._peek() == ',':
+                self.pos += 1
+                continue
+            self._expect('}')
+            return
+
+    def _members(self, opening):
+        self.pos += 1
+        closing = ']' if opening == '[' else '}'
+        if self._peek() == closing:
+            self.pos += 1
+            return
+        while True:
+            if opening == '[':
+                yield self._decode()
+            else:
+                key = self._string()
+                self._expect(':')
+                self._peek()
+                yield key, self._decode()
+            if self._peek() == ',':
+                self.pos += 1
+                continue
+            self._expect(closing)
+            return
+
+    def _fill(self):
+        ''' Read another chunk, dropping what was consumed already '''
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        ''' Skip whitespace and return the next character '''
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError('unexpected end of JSON document')
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError('expected %r at %r' % (char, self.buf[
+                self.pos:self.pos + 20]))
+        self.pos += 1
+
+    def _match(self, pattern):
+        ''' Match pattern at pos, reading more until it can not grow '''
+        while True:
+            match = pattern.match(self.buf, self.pos)
+            if match is not None and (match.end() < len(self.buf) or
+                                      self.eof):
+                return match
+            if not self._fill():
+                if match is None:
+                    raise ValueError('malformed JSON document')
+                return match
+
+    def _string(self):
+        if self._peek() != '"':
+            raise ValueError('expected a key at %r' % self.buf[
+                self.pos:self.pos + 20])
+        match = self._match(_STRING)
+        self.pos = match.end()
+        return json.loads(match.group())
+
+    def _decode(self):
+        if self._peek() not in '"[{':
+            # a number or literal may go on in the next chunk
+            match = self._match(_SCALAR)
+            self.pos = match.end()
+            return json.loads(match.group())
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # most likely cut short, anything else fails at eof
+                if not self._fill():
+                    raise
+                continue
+            self.pos = end
+            return value
+
+    def _skip_value(self):
+        char = self._peek()
+        if char == '"':
+            self.pos = self._match(_STRING).end()
+            return
+        if char not in '[{':
+            self.pos = self._match(_SCALAR).end()
+            return
+        depth = 0
+        while True:
+            match = _STRUCTURE.search(self.buf, self.pos)
+            if match is None:
+                self.pos = len(self.buf)
+                if not self._fill():
+                    raise ValueError('unexpected end of JSON document')
+                continue
+            self.pos = match.start()
+            char = match.group()
+            if char == '"':
+                self.pos = self._match(_STRING).end()
+                continue
+            self.pos += 1
+            depth += 1 if char in '[{' else -1
+            if depth == 0:
+                return
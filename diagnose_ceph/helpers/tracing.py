@@ -0,0 +1,117 @@
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+from exceptions import TimeoutError
+
+
+class Span(object):
+    """ One timed remote execution, connection setup or poll iteration.
+
+        Args:
+            kind (str): what was timed(exec, juju_batch, gather, connect,
+                eof_wait, poll, copy).
+            command (str): command run, None for connections.
+            target (str): host or juju machine(s) it ran on.
+            transport (str): ssh, juju or local.
+            start (float): epoch seconds it started at.
+            duration (float): seconds it took.
+            bytes (int): output size, None when the caller reads it later.
+            outcome (str): ok, failed(non zero exit), not_reached(poll of a
+                state the cluster is not in yet), timeout or error.
+            retries (int): attempts made before this one.
+    """
+    __slots__ = ('kind', 'command', 'target', 'transport', 'start',
+                 'duration', 'bytes', 'outcome', 'retries')
+
+    def __init__(self, kind, command=None, target=None, transport=None,
+                 start=None, duration=None, bytes=None, outcome='ok',
+                 retries=0):
+        self.kind = kind
+        self.command = command
+        self.target = target
+        self.transport = transport
+        self.start = time.time() if start is None else start
+        self.duration = duration
+        self.bytes = bytes
+        self.outcome = outcome
+        self.retries = retries
+
+    def as_dict(self):
+        return dict((field, getattr(self, field)) for field in self.__slots__)
+
+    @property
+    def label(self):
+        ''' Short one line name of the command for the summary table '''
+        if self.command is None:
+            return self.kind + ' ' + str(self.target)
+        label = ' '.join(self.command.split())
+        return label if len(label) <= 48 else label[:45] + '...'
+
+
+class Tracer(object):
+    """ Collects spans from every thread.
+
+        Spans are streamed to a JSONL file when a path is given and folded
+        into per kind/command totals for the exit summary, so memory stays
+        flat however long the run.
+
+        Args:
+            path (str): JSONL file spans are appended to, None to only keep
+                the totals.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.totals = {}
+        self._file = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, kind, command=None, target=None, transport=None,
+             retries=0):
+        ''' Time the enclosed block, the yielded Span can be amended '''
+        span = Span(kind, command, target, transport, retries=retries)
+        try:
+            yield span
+        except TimeoutError:
+            span.outcome = 'timeout'
+            raise
+        except Exception:
+            span.outcome = 'error'
+            raise
+        finally:
+            span.duration = time.time() - span.start
+            self.record(span)
+
+    def record(self, span):
+        with self._lock:
+            key = (span.kind, span.label)
+            total = self.totals.setdefault(key, [0, 0.0, 0.0, 0])
+            total[0] += 1
+            total[1] += span.duration
+            total[2] = max(total[2], span.duration)
+            total[3] += 0 if span.outcome == 'ok' else 1
+            if self.path is not None:
+                if self._file is None:
+                    self._file = open(self.path, 'a')
+                self._file.write(json.dumps(span.as_dict()) + '\n')
+                self._file.flush()
+
+    def summary(self, top=10):
+        '''
+            Returns:
+                list: (kind, label, count, total, max, failures) of the top
+                    consumers by total time.
+        '''
+        with self._lock:
+            rows = [key + tuple(total) for key, total
+                    in self.totals.iteritems()]
+        return sorted(rows, key=lambda row: row[3], reverse=True)[:top]
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
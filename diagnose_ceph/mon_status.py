@@ -0,0 +1,78 @@
+import hashlib
+import json
+
+
+class MonmapEntry(object):
+    """ A mon as listed in the monmap.
+
+        Args:
+            name (str): mon name(ex the hostname for juju deployed mons).
+            rank (int): rank of the mon in the monmap.
+            addr (str): public addr as ip:port/nonce.
+    """
+
+    def __init__(self, name, rank, addr):
+        self.name = name
+        self.rank = rank
+        self.addr = addr
+
+    @property
+    def ip(self):
+        return self.addr.split(':')[0]
+
+
+class MonStatus(object):
+    """ Parsed `mon_status` of a monitor, from the ceph cli or admin socket.
+
+        The monmap is indexed by name, rank and ip once, so callers never
+        have to scan the mon list themselves.
+
+        Args:
+            name (str): name of the mon that answered.
+            state (str): its state(leader/peon/probing/electing...).
+            epoch (int): monmap epoch.
+            quorum (list): ranks of the mons in quorum.
+            mons (list): MonmapEntry objects of the monmap.
+    """
+    COMMAND = 'sudo ceph mon_status --format json'
+
+    def __init__(self, name, state, epoch, quorum, mons):
+        self.name = name
+        self.state = state
+        self.epoch = epoch
+        self.quorum = set(quorum)
+        self.mons = mons
+        self.by_name = dict((mon.name, mon) for mon in mons)
+        self.by_rank = dict((mon.rank, mon) for mon in mons)
+        self.by_ip = dict((mon.ip, mon) for mon in mons)
+
+    @classmethod
+    def from_json(cls, text):
+        status = json.loads(text)
+        monmap = status['monmap']
+        mons = [MonmapEntry(mon['name'], mon['rank'], mon.get('addr', ''))
+                for mon in monmap['mons']]
+        return cls(status.get('name'), status.get('state'),
+                   monmap.get('epoch'), status.get('quorum', []), mons)
+
+    @property
+    def digest(self):
+        '''
+            (epoch, hash of the mon names and addrs) of the monmap, equal
+            for mons holding the same map whatever the order listed.
+        '''
+        content = json.dumps(sorted((mon.name, mon.addr)
+                                    for mon in self.mons))
+        return self.epoch, hashlib.sha1(content).hexdigest()
+
+    @property
+    def names(self):
+        return sorted(self.by_name)
+
+    @property
+    def quorum_names(self):
+        return sorted(self.by_rank[rank].name for rank in self.quorum
+                      if rank in self.by_rank)
+
+    def out_of_quorum(self):
+        return [mon for mon in self.mons if mon.rank not in self.quorum]
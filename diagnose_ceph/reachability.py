@@ -0,0 +1,177 @@
+class ReachabilityMatrix(object):
+    """ Which mons can open a connection to which, and how fast.
+
+        Every live mon host gets a single command trying the mon port of
+        every address of every other mon at once, each attempt bounded by
+        timeout, and all hosts run it at the same time. A cluster of N mons
+        costs one parallel round of N commands instead of N*N connections.
+
+        Latencies are the time to connect, a bash start included, so they
+        are an upper bound.
+
+        Args:
+            troubleshooter: TroubleshootCeph class or instance whose gather
+                runs the probes.
+            port (int): mon port probed.
+            timeout (int): seconds a connection attempt may take.
+    """
+    PROBE = ('for a in %s; do (s=$(date +%%s%%N); '
+             'if timeout %d bash -c "exec 3<>/dev/tcp/${a%%:*}/${a#*:}" '
+             '2>/dev/null; then echo "$a up $(( ($(date +%%s%%N) - s) / '
+             '1000 ))"; else echo "$a down"; fi) & done; wait')
+
+    def __init__(self, troubleshooter, port=6789, timeout=1):
+        self.troubleshooter = troubleshooter
+        self.port = port
+        self.timeout = timeout
+        self.mons = []
+        # (source, target) -> {kind: latency in ms or None}
+        self.cells = {}
+
+    def _name(self, mon):
+        ''' mon_id, or the address of mons never reached '''
+        return mon.mon_id or mon.host
+
+    def addresses(self, mon):
+        '''
+            (kind, ip) of the public and internal addresses of mon, the
+            internal one is left out when the same or unknown.
+        '''
+        ts = self.troubleshooter
+        addresses = [('public', mon.host)]
+        internal = None
+        machine = ts.registry.machine_by_public_addr(mon.host)
+        if machine is not None:
+            internal = machine.internal_ip
+        if internal is None and mon.connection is not None:
+            facts = ts.host_facts.get(ts._facts_key(mon.connection))
+            internal = (facts or {}).get('internal_ip')
+        if internal is not None and internal != mon.host:
+            addresses.append(('internal', internal))
+        return addresses
+
+    def measure(self, mons):
+        ''' Probe from every mon with a connection to all the others '''
+        ts = self.troubleshooter
+        self.mons = list(mons)
+        self.cells = {}
+        sources = [mon for mon in self.mons if mon.connection is not None]
+        addresses = dict((mon, self.addresses(mon)) for mon in self.mons)
+        jobs = []
+        for source in sources:
+            endpoints = ['%s:%d' % (ip, self.port)
+                         for mon in self.mons if mon is not source
+                         for kind, ip in addresses[mon]]
+            jobs.append((source.connection, self.PROBE % (
+                ' '.join(endpoints), self.timeout)))
+        results = ts.gather(jobs, self.timeout + ts.COMMAND_TIMEOUT)
+        for source, result in zip(sources, results):
+            if not result.ok:
+                continue  # row left unknown
+            seen = {}
+            for line in result.stdout.splitlines():
+                fields = line.split()
+                if len(fields) == 3 and fields[1] == 'up':
+                    seen[fields[0]] = int(fields[2]) / 1000.0
+                elif len(fields) == 2:
+                    seen[fields[0]] = None
+            for mon in self.mons:
+                if mon is source:
+                    continue
+                self.cells[(self._name(source), self._name(mon))] = dict(
+                    (kind, seen.get('%s:%d' % (ip, self.port)))
+                    for kind, ip in addresses[mon])
+        return self
+
+    def reachable(self, source, target):
+        '''
+            True if source reached any address of target, None when source
+            could not be probed from.
+        '''
+        cell = self.cells.get((source, target))
+        if cell is None:
+            return None
+        return any(latency is not None for latency in cell.values())
+
+    def unprobed(self):
+        '''
+            mon_ids(addresses for mons never reached) without a single
+            probed link to or from another mon, nothing is known of them.
+        '''
+        names = [self._name(mon) for mon in self.mons]
+        if len(names) < 2:
+            return []
+        return [name for name in names
+                if all(self.reachable(name, other) is None and
+                       self.reachable(other, name) is None
+                       for other in names if other != name)]
+
+    def partitions(self):
+        '''
+            Groups of mons able to reach each other, both ways wherever
+            both were probed from. Only probed links join mons, the
+            unprobed() ones are left out.
+
+            Returns:
+                list: sets of mon_ids(addresses for mons never reached),
+                    the largest first.
+        '''
+        unknown = self.unprobed()
+        names = [self._name(mon) for mon in self.mons
+                 if self._name(mon) not in unknown]
+
+        def linked(a, b):
+            known = [seen for seen in (self.reachable(a, b),
+                                       self.reachable(b, a))
+                     if seen is not None]
+            return bool(known) and all(known)
+
+        groups = []
+        left = list(names)
+        while left:
+            group = set([left.pop(0)])
+            grown = True
+            while grown:
+                grown = False
+                for name in list(left):
+                    if any(linked(name, member) for member in group):
+                        group.add(name)
+                        left.remove(name)
+                        grown = True
+            groups.append(group)
+        return sorted(groups, key=len, reverse=True)
+
+    def report(self):
+        ''' Print the matrix, rows probing columns, and any partition '''
+        names = [self._name(mon) for mon in self.mons]
+        width = max([len(str(name)) for name in names] + [9])
+        print ' ' * width, ' '.join(str(n).rjust(width) for n in names)
+        for source in names:
+            row = []
+            for target in names:
+                cell = self.cells.get((source, target))
+                if source == target:
+                    text = '-'
+                elif cell is None:
+                    text = '?'
+                else:
+                    up = [latency for latency in cell.values()
+                          if latency is not None]
+                    text = '%.1fms' % min(up) if up else 'down'
+                    if up and len(up) < len(cell):
+                        # some addresses of the mon did not answer
+                        text += '!'
+                row.append(text.rjust(width))
+            print str(source).rjust(width), ' '.join(row)
+        print '? not probed, ! only some addresses reachable'
+        unknown = self.unprobed()
+        if unknown:
+            print 'Could not probe:', \
+                ', '.join(sorted(str(name) for name in unknown))
+        groups = self.partitions()
+        if len(groups) > 1:
+            for group in groups[1:]:
+                print 'Partitioned from the majority:', \
+                    ', '.join(sorted(str(name) for name in group))
+        elif groups:
+            print 'No network partition between mons'
@@ -0,0 +1,58 @@
+class MachineRegistry(object):
+    """ Holds every JujuCephMachine, MonObject and OsdObject of the cluster
+        with constant time lookups.
+
+        Note:
+            A juju machine running both a ceph and a ceph-osd unit shows up
+            as two JujuCephMachine objects, lookups return the first one
+            added (discovery adds the mon units first). Mon and osd objects
+            are rebuilt on every troubleshoot run, so the latest one added
+            wins for those.
+    """
+
+    def __init__(self, machines=()):
+        self.machines = []
+        self.mons = []
+        self.osds = []
+        self._machines_by = {'juju_id': {}, 'hostname': {},
+                             'public_addr': {}, 'internal_ip': {}}
+        self._mons_by_id = {}
+        self._osds_by_id = {}
+        for machine in machines:
+            self.add_machine(machine)
+
+    def add_machine(self, machine):
+        self.machines.append(machine)
+        keys = {'juju_id': str(machine.id), 'hostname': machine.hostname,
+                'public_addr': machine.public_addr,
+                'internal_ip': machine.internal_ip}
+        for index, key in keys.iteritems():
+            if key is not None:
+                self._machines_by[index].setdefault(key, machine)
+
+    def add_mon(self, mon):
+        self.mons.append(mon)
+        if mon.mon_id is not None:
+            self._mons_by_id[mon.mon_id] = mon
+
+    def add_osd(self, osd):
+        self.osds.append(osd)
+        self._osds_by_id[osd.osd_id] = osd
+
+    def machine_by_juju_id(self, juju_id):
+        return self._machines_by['juju_id'].get(str(juju_id))
+
+    def machine_by_hostname(self, hostname):
+        return self._machines_by['hostname'].get(hostname)
+
+    def machine_by_public_addr(self, addr):
+        return self._machines_by['public_addr'].get(addr)
+
+    def machine_by_internal_ip(self, ip):
+        return self._machines_by['internal_ip'].get(ip)
+
+    def mon_by_id(self, mon_id):
+        return self._mons_by_id.get(mon_id)
+
+    def osd_by_id(self, osd_id):
+        return self._osds_by_id.get(osd_id)
@@ -0,0 +1,105 @@
+import json
+import time
+
+# Remediation classes a policy can pre-approve or forbid
+ACTIONS = ('restart_mons', 'restart_ntp', 'inject_monmap', 'restart_osds',
+           'ssh_fallback')
+
+# What happens to an action the policy does not mention. OSD restarts have
+# always run without a prompt.
+DEFAULTS = {'restart_osds': 'allow'}
+
+
+class RemediationPolicy(object):
+    """ Decides which remediation steps may run without asking.
+
+        Args:
+            decisions (dict): action -> 'allow', 'deny' or 'ask'.
+            unattended (bool): never prompt, actions left at 'ask' are
+                denied.
+            step_timeout (int): seconds a step (remediation plus the wait
+                for its effect) may take, 0 for no limit.
+            timeouts (dict): action -> step_timeout overriding the default.
+    """
+
+    def __init__(self, decisions=None, unattended=False, step_timeout=0,
+                 timeouts=None):
+        self.decisions = dict(DEFAULTS, **(decisions or {}))
+        self.unattended = unattended
+        self.step_timeout = int(step_timeout)
+        self.timeouts = timeouts or {}
+        for action in list(self.decisions) + list(self.timeouts):
+            if action not in ACTIONS:
+                raise ValueError('unknown remediation ' + action +
+                                 ', expected one of ' + ', '.join(ACTIONS))
+
+    @classmethod
+    def from_options(cls, options):
+        '''
+            Policy of the --policy file, overridden by --allow/--deny. The
+            file is JSON: {"allow": [...], "deny": [...], "unattended":
+            true, "step_timeout": 600, "timeouts": {"inject_monmap": 900}}
+        '''
+        config = {}
+        if options.policy is not None:
+            with open(options.policy, 'r') as f:
+                config = json.load(f)
+        decisions = {}
+        for decision in ('allow', 'deny'):
+            for action in config.get(decision, []):
+                decisions[action] = decision
+        for action in options.allow:
+            decisions[action] = 'allow'
+        for action in options.deny:
+            decisions[action] = 'deny'
+        step_timeout = options.step_timeout
+        if step_timeout is None:
+            step_timeout = config.get('step_timeout', 0)
+        return cls(decisions,
+                   options.unattended or config.get('unattended', False),
+                   step_timeout, config.get('timeouts'))
+
+    def decide(self, action):
+        decision = self.decisions.get(action, 'ask')
+        if decision == 'ask' and self.unattended:
+            return 'deny'
+        return decision
+
+    def timeout(self, action):
+        return int(self.timeouts.get(action, self.step_timeout))
+
+
+class RemediationOutcome(object):
+    """ Machine readable record of a diagnosis run.
+
+        Every remediation offered is a step with the decision taken, and
+        when it ran how long it took, how it ended and the cluster status
+        seen afterwards.
+    """
+
+    def __init__(self):
+        self.steps = []
+        self.status = None
+        self.started = time.time()
+
+    def add_step(self, action, decision, approved):
+        step = {'action': action, 'decision': decision,
+                'approved': approved, 'result': 'skipped', 'status': None,
+                'duration': None, 'error': None}
+        self.steps.append(step)
+        return step
+
+    @property
+    def result(self):
+        if self.status not in ('HEALTH_OK', 'OSD_OK'):
+            return 'unresolved'
+        ran = [step for step in self.steps if step['result'] == 'ok']
+        return 'recovered' if ran else 'healthy'
+
+    def as_dict(self):
+        return {'result': self.result, 'status': self.status,
+                'duration': time.time() - self.started, 'steps': self.steps}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
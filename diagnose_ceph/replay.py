@@ -0,0 +1,353 @@
+import errno
+import fcntl
+import json
+import os
+import re
+import select
+import signal
+import socket
+import threading
+import time
+from base64 import b64decode
+
+JUJU_RUN = re.compile(r'^juju run (?P<format>--format json )?--machine '
+                      r'(?P<machines>\S+) --timeout \S+ '
+                      r'"`echo (?P<payload>\S+) \| base64 --decode`"$')
+
+
+class ReplayTransport(object):
+    """ Offline stand-in for the ssh hosts and the local juju cli of a
+        cluster, answering every command from fixtures.
+
+        Set it as TroubleshootCeph.transport and every ssh connection,
+        `juju run`, `juju status` and `juju --version` is served from here
+        instead of the network.
+
+        Args:
+            responders (list): (regex, answer) pairs tried in order against
+                every command, the first match answers. answer is the
+                stdout, a (stdout, stderr, exit_status) tuple or a callable
+                answer(host, match) returning either.
+            files (dict): remote path -> content served by sftp get, the
+                content may also be a callable content(host).
+            latency (list): (regex, seconds) pairs, commands matching a
+                regex take that long to answer.
+            default_latency (float): seconds taken by every other command.
+            machines (dict): juju machine id -> host the commands run on.
+            unreachable (iterable): hosts ssh connections to fail for.
+    """
+
+    def __init__(self, responders, files=None, latency=None,
+                 default_latency=0, machines=None, unreachable=()):
+        self.responders = [(re.compile(pattern), answer)
+                           for pattern, answer in responders]
+        self.files = files or {}
+        self.latency = [(re.compile(pattern), seconds)
+                        for pattern, seconds in (latency or [])]
+        self.default_latency = default_latency
+        self.machines = dict((str(k), v) for k, v
+                             in (machines or {}).iteritems())
+        self.unreachable = set(unreachable)
+        self.uploads = {}
+        self.history = []
+        self.calls = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path):
+        ''' Load recorded fixtures from a JSON file with the __init__ keys '''
+        with open(path, 'r') as f:
+            fixtures = json.load(f)
+        return cls(**fixtures)
+
+    def connect(self, hostname):
+        if hostname in self.unreachable:
+            raise socket.error('replay: ' + hostname + ' is unreachable')
+        with self._lock:
+            self.connections += 1
+        return ReplayClient(self, hostname)
+
+    def answer(self, host, command, count=True):
+        '''
+            Answer command as run on host, count tells whether it is a
+            round trip of its own.
+
+            Returns:
+                tuple: (stdout, stderr, exit_status, latency). Commands
+                    without a fixture fail with exit status 127.
+        '''
+        with self._lock:
+            self.calls += 1 if count else 0
+            self.history.append((host, command))
+        delay = self.default_latency
+        for pattern, seconds in self.latency:
+            if pattern.search(command):
+                delay = seconds
+                break
+        for pattern, answer in self.responders:
+            match = pattern.search(command)
+            if match is None:
+                continue
+            if callable(answer):
+                answer = answer(host, match)
+            if isinstance(answer, basestring):
+                answer = (answer, '', 0)
+            return tuple(answer) + (delay,)
+        return ('', 'replay: no fixture for ' + command, 127, delay)
+
+    def run_local(self, cmd, deadline=None, command=None):
+        ''' Answer a local shell command, returns (stdout, stderr) '''
+        out, err, status, delay = self._answer_local(cmd)
+        self._sleep(delay, deadline, command)
+        return out, err
+
+    def spawn_local(self, cmd):
+        ''' Start a local shell command, returns its ReplayProcess '''
+        return ReplayProcess(*self._answer_local(cmd))
+
+    def _answer_local(self, cmd):
+        ''' (stdout, stderr, exit_status, latency) of a local command '''
+        run = JUJU_RUN.match(cmd)
+        if run is None:
+            return self.answer(None, cmd)
+
+        payload = b64decode(run.group('payload'))
+        results = []
+        delay = 0
+        with self._lock:
+            # one juju run is one round trip, whatever it fans out to
+            self.calls += 1
+        for machine_id in run.group('machines').split(','):
+            host = self.machines.get(machine_id, machine_id)
+            out, err, status, latency = self.answer(host, payload, False)
+            delay = max(delay, latency)
+            results.append({'MachineId': machine_id, 'Stdout': out,
+                            'Stderr': err, 'ReturnCode': status})
+        if run.group('format'):
+            return json.dumps(results), '', 0, delay
+        return (results[0]['Stdout'], results[0]['Stderr'],
+                results[0]['ReturnCode'], delay)
+
+    def _sleep(self, delay, deadline, command):
+        if deadline is not None and delay > deadline.remaining():
+            time.sleep(deadline.remaining())
+            raise deadline.error(command)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ReplayProcess(object):
+    """ subprocess.Popen look alike of a local command. Its output is
+        written to real pipes once its latency passed, so select() sees it
+        arrive as it would from a juju run.
+    """
+
+    def __init__(self, out, err, status, delay):
+        self.returncode = None
+        self._status = status
+        self._killed = threading.Event()
+        self._pipes = []
+        files = []
+        for data in (out, err):
+            read_fd, write_fd = os.pipe()
+            # a reader gone away must not block the writer
+            fcntl.fcntl(write_fd, fcntl.F_SETFL, os.O_NONBLOCK)
+            files.append(os.fdopen(read_fd, 'rb'))
+            self._pipes.append((write_fd, data))
+        self.stdout, self.stderr = files
+        self._writer = threading.Thread(target=self._write, args=(delay,))
+        self._writer.daemon = True
+        self._writer.start()
+
+    def _write(self, delay):
+        if not self._killed.wait(delay):
+            for fd, data in self._pipes:
+                while data and not self._killed.is_set():
+                    if not select.select([], [fd], [], 0.1)[1]:
+                        continue
+                    try:
+                        data = data[os.write(fd, data[:65536]):]
+                    except OSError as err:
+                        if err.errno != errno.EAGAIN:
+                            break
+        for fd, data in self._pipes:
+            os.close(fd)
+
+    def kill(self):
+        self._killed.set()
+
+    def wait(self):
+        self._writer.join()
+        if self.returncode is None:
+            self.returncode = -signal.SIGKILL if self._killed.is_set() \
+                else self._status
+        return self.returncode
+
+
+class ReplayClient(object):
+    ''' paramiko.SSHClient look alike connected to one replayed host '''
+
+    def __init__(self, transport, host):
+        self.transport = transport
+        self.host = host
+        self.active = True
+
+    def exec_command(self, command, timeout=None, get_pty=False):
+        channel = self.open_session()
+        channel.settimeout(timeout)
+        channel.exec_command(command)
+        return (None, ReplayFile(channel),
+                ReplayFile(channel, stderr=True))
+
+    def open_session(self):
+        return ReplayChannel(self.transport, self.host)
+
+    def open_sftp(self):
+        return ReplaySFTP(self.transport, self.host)
+
+    # the client doubles as its own transport
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return self.active
+
+    def send_ignore(self):
+        pass
+
+    def getpeername(self):
+        return (self.host, 22)
+
+    def close(self):
+        self.active = False
+
+
+class ReplayChannel(object):
+    ''' paramiko.Channel look alike, the answer arrives after its latency '''
+
+    def __init__(self, transport, host):
+        self.transport = transport
+        self.host = host
+        self.status_event = threading.Event()
+        self.eof_received = False
+        self.closed = False
+        self.timeout = None
+        self._out = ''
+        self._err = ''
+        self._exit_status = -1
+        self._pipe = None
+        self._lock = threading.Lock()
+
+    def exec_command(self, command):
+        out, err, status, delay = self.transport.answer(self.host, command)
+        if delay > 0:
+            timer = threading.Timer(delay, self._finish, (out, err, status))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._finish(out, err, status)
+
+    def _finish(self, out, err, status):
+        with self._lock:
+            self._out, self._err, self._exit_status = out, err, status
+            self.eof_received = True
+            if self._pipe is not None:
+                os.write(self._pipe[1], 'x')
+        self.status_event.set()
+
+    def fileno(self):
+        ''' Readable once the answer arrived, for select() '''
+        with self._lock:
+            if self._pipe is None:
+                self._pipe = os.pipe()
+                if self.eof_received:
+                    os.write(self._pipe[1], 'x')
+        return self._pipe[0]
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def setblocking(self, blocking):
+        self.timeout = None if blocking else 0.0
+
+    def wait(self):
+        ''' Wait for the answer within the channel timeout '''
+        if not (self.eof_received or self.status_event.wait(self.timeout)):
+            raise socket.timeout()
+
+    def recv_ready(self):
+        return self.eof_received and self._out != ''
+
+    def recv_stderr_ready(self):
+        return self.eof_received and self._err != ''
+
+    def recv(self, nbytes):
+        self.wait()
+        data, self._out = self._out[:nbytes], self._out[nbytes:]
+        return data
+
+    def recv_stderr(self, nbytes):
+        self.wait()
+        data, self._err = self._err[:nbytes], self._err[nbytes:]
+        return data
+
+    def exit_status_ready(self):
+        return self.eof_received
+
+    def recv_exit_status(self):
+        self.status_event.wait()
+        return self._exit_status
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            if self._pipe is not None:
+                os.close(self._pipe[0])
+                os.close(self._pipe[1])
+                self._pipe = None
+
+
+class ReplayFile(object):
+    ''' stdout/stderr of exec_command on a ReplayChannel '''
+
+    def __init__(self, channel, stderr=False):
+        self.channel = channel
+        self.stderr = stderr
+
+    def read(self, size=-1):
+        self.channel.wait()
+        if self.stderr:
+            data = self.channel.recv_stderr(len(self.channel._err)
+                                            if size < 0 else size)
+        else:
+            data = self.channel.recv(len(self.channel._out)
+                                     if size < 0 else size)
+        return data
+
+    def readlines(self):
+        return self.read().splitlines(True)
+
+
+class ReplaySFTP(object):
+    ''' sftp client serving the transport's files '''
+
+    def __init__(self, transport, host):
+        self.transport = transport
+        self.host = host
+
+    def get(self, remotepath, localpath):
+        if remotepath not in self.transport.files:
+            raise IOError(2, 'No such file', remotepath)
+        content = self.transport.files[remotepath]
+        if callable(content):
+            content = content(self.host)
+        with open(localpath, 'w') as f:
+            f.write(content)
+
+    def put(self, localpath, remotepath):
+        with open(localpath, 'r') as f:
+            self.transport.uploads[(self.host, remotepath)] = f.read()
+
+    def close(self):
+        pass
@@ -0,0 +1,126 @@
+import time
+
+from helpers.deadline import current_deadline
+
+
+class RestartJob(object):
+    """ A daemon waiting to be restarted by the RestartScheduler.
+
+        Args:
+            daemon (:obj:`MonObject/OsdObject`): the daemon to restart.
+            name (str): daemon name used in the report(ex osd.3, mon.a).
+            host (str): host the daemon lives on.
+            domain (str): failure domain (ex the crush rack) the daemon
+                belongs to, None when unknown.
+    """
+
+    def __init__(self, daemon, name, host, domain=None):
+        self.daemon = daemon
+        self.name = name
+        self.host = host
+        self.domain = domain
+        self.restarted = False
+        self.came_up = False
+        self.restart_time = None
+        self.up_time = None
+
+    @property
+    def result(self):
+        if not self.restarted:
+            return 'restart failed'
+        return 'up' if self.came_up else 'not up'
+
+
+class RestartScheduler(object):
+    """ Restarts daemons in waves of bounded size.
+
+        A wave holds at most `concurrency` daemons, at most `per_host` of
+        them on the same host and at most `per_domain` in the same failure
+        domain (0 means no limit). The next wave starts once every daemon of
+        the current one is back up or `verify_timeout` has passed. Waves
+        stop at the deadline of the enclosing deadline scope, raising
+        TimeoutError.
+
+        Args:
+            restart (callable): restart(daemons) restarts a wave and returns
+                {daemon: bool} telling whether the start command succeeded.
+            check (callable): check(daemons) returns the subset of daemons
+                that are up.
+    """
+
+    def __init__(self, restart, check, concurrency=4, per_host=0,
+                 per_domain=0, verify_timeout=60, verify_interval=2):
+        self.restart = restart
+        self.check = check
+        self.concurrency = max(1, int(concurrency))
+        self.per_host = int(per_host)
+        self.per_domain = int(per_domain)
+        self.verify_timeout = verify_timeout
+        self.verify_interval = verify_interval
+
+    def run(self, jobs):
+        pending = list(jobs)
+        scope = current_deadline()
+        while pending:
+            if scope is not None:
+                scope.check('restart')
+            wave = self._next_wave(pending)
+            pending = [job for job in pending if job not in wave]
+            self._run_wave(wave)
+        return jobs
+
+    def _next_wave(self, pending):
+        wave, hosts, domains = [], {}, {}
+        for job in pending:
+            if len(wave) == self.concurrency:
+                break
+            if self.per_host and hosts.get(job.host, 0) >= self.per_host:
+                continue
+            if (self.per_domain and job.domain is not None and
+                    domains.get(job.domain, 0) >= self.per_domain):
+                continue
+            wave.append(job)
+            hosts[job.host] = hosts.get(job.host, 0) + 1
+            domains[job.domain] = domains.get(job.domain, 0) + 1
+        return wave
+
+    def _run_wave(self, wave):
+        print 'Restarting ' + ', '.join(job.name for job in wave)
+        start = time.time()
+        succeeded = self.restart([job.daemon for job in wave])
+        for job in wave:
+            job.restart_time = time.time() - start
+            job.restarted = bool(succeeded.get(job.daemon))
+
+        waiting = [job for job in wave if job.restarted]
+        deadline = start + self.verify_timeout
+        scope = current_deadline()
+        if scope is not None:
+            deadline = min(deadline, scope.expires)
+        while waiting:
+            up = self.check([job.daemon for job in waiting])
+            for job in [j for j in waiting if j.daemon in up]:
+                job.came_up = True
+                job.up_time = time.time() - start
+                waiting.remove(job)
+            if not waiting or time.time() >= deadline:
+                break
+            time.sleep(min(self.verify_interval,
+                           max(deadline - time.time(), 0)))
+
+    @staticmethod
+    def report(jobs):
+        if not jobs:
+            return
+        print '\n%-12s %-20s %-12s %9s %9s  %s' % ('daemon', 'host', 'domain',
+                                                   'restart', 'up after',
+                                                   'result')
+        for job in jobs:
+            restart = up = '-'
+            if job.restart_time is not None:
+                restart = '%.1fs' % job.restart_time
+            if job.up_time is not None:
+                up = '%.1fs' % job.up_time
+            print '%-12s %-20s %-12s %9s %9s  %s' % (job.name, job.host,
+                                                     job.domain or '-',
+                                                     restart, up, job.result)
@@ -1,11 +1,20 @@
+import atexit
+
 from helpers.exceptions import QuorumIssueNotResolvedError
 from troubleshoot_ceph import TroubleshootCeph
 from troubleshoot_ceph_mon import TroubleshootCephMon
 from troubleshoot_ceph_osd import TroubleshootCephOsd
+from watchdog import Watchdog
 
 
 def run():
     TroubleshootCeph_ = TroubleshootCeph()
+    atexit.register(TroubleshootCeph.report_connection_stats)
+    atexit.register(TroubleshootCeph.report_trace)
+    atexit.register(TroubleshootCeph.report_outcome)
+    if TroubleshootCeph_.options.watch is not None:
+        Watchdog(TroubleshootCeph_.options.watch).run()
+        return
     cluster_status = TroubleshootCeph_.start_troubleshoot()
     if cluster_status == 'HEALTH_OK':
         print 'All good with monitors up here :-)'
@@ -0,0 +1,14 @@
+init=`(if [[ \`/sbin/init --version\` =~ upstart ]]; then echo upstart;
+elif [[ \`systemctl\` =~ -\.mount ]]; then echo systemd;
+elif [[ -f /etc/init.d/cron && ! -h /etc/init.d/cron ]]; then echo sysv-init;
+else echo none; fi) 2> /dev/null`
+if [ -z "`grep -w lm /proc/cpuinfo`" ]; then arch=32bit; else arch=64bit; fi
+hostname=`cat /etc/hostname`
+internal_ip=`host $hostname 2> /dev/null | head -n 1 | awk '{print $NF}'`
+sockets=''
+for s in `ls /var/run/ceph 2> /dev/null`; do
+    sockets="$sockets${sockets:+, }\"$s\""
+done
+printf '{"init_type": "%s", "arch_type": "%s", "hostname": "%s", ' \
+    "$init" "$arch" "$hostname"
+printf '"internal_ip": "%s", "sockets": [%s]}\n' "$internal_ip" "$sockets"
@@ -0,0 +1,197 @@
+import json
+import re
+import socket
+import time
+
+from helpers.deadline import current_deadline, effective_deadline
+from helpers.exceptions import TimeoutError
+from helpers.helpers import MyStr
+
+
+class WatchTarget(object):
+    """ A cluster state the StatusWatcher waits for.
+
+        Args:
+            name (str): what is being waited for, used in messages.
+            command (str): ceph command whose output tells the current state.
+            check (callable): check(output) returns (reached, status).
+            trigger (str): regex matched against `ceph -w` lines, a matching
+                line makes the watcher run command again to confirm.
+    """
+
+    def __init__(self, name, command, check, trigger):
+        self.name = name
+        self.command = command
+        self.check = check
+        self.trigger = re.compile(trigger)
+
+
+def health_ok(command='sudo ceph health'):
+    def check(out):
+        status = out.split(' ')[0].strip()
+        return status == 'HEALTH_OK', status
+    return WatchTarget('HEALTH_OK', command, check,
+                       r'HEALTH_OK|[Cc]luster is now healthy')
+
+
+def osd_stat_status(out):
+    ''' OSD_FULL, OSD_OK or OSD_NOT_OK from `ceph osd stat --format json` '''
+    stat = json.loads(out)
+    stat = stat.get('osdmap', stat)
+    if stat.get('full') or stat.get('nearfull'):
+        return 'OSD_FULL'
+    elif (stat['num_osds'] == stat['num_up_osds'] and
+          stat['num_up_osds'] == stat['num_in_osds']):
+        return 'OSD_OK'
+    return 'OSD_NOT_OK'
+
+
+def osds_up_in():
+    def check(out):
+        status = osd_stat_status(out)
+        return status == 'OSD_OK', status
+    return WatchTarget('all osds up/in', 'sudo ceph osd stat --format json',
+                       check, r'osd\.\d+.*boot|osdmap e\d+')
+
+
+def mons_in_quorum(names):
+    def check(out):
+        quorum = json.loads(out).get('quorum_names', [])
+        missing = [name for name in names if name not in quorum]
+        return not missing, 'QUORUM_OK' if not missing else 'QUORUM_MISSING'
+    return WatchTarget('mon.' + ', mon.'.join(names) + ' in quorum',
+                       'sudo ceph quorum_status --format json', check,
+                       r'mon\.\S+.*(election|quorum)')
+
+
+class StatusWatcher(object):
+    """ Waits for a WatchTarget with as few ceph commands as possible.
+
+        Over ssh a single `ceph -w` session is kept open and the target is
+        only re-checked when a relevant cluster log line shows up. Juju run
+        can not stream, so there and whenever `ceph -w` is unusable the
+        target is polled with exponential backoff.
+
+        Args:
+            troubleshooter (:obj:`TroubleshootCeph`): supplies command
+                execution and is_juju.
+            connection: connection the ceph commands are run on.
+    """
+    STREAM_COMMAND = 'sudo ceph -w --format json'
+    MAX_DELAY = 10
+
+    def __init__(self, troubleshooter, connection):
+        self.troubleshooter = troubleshooter
+        self.connection = connection
+        # whether the last check found the target reached
+        self.reached = False
+
+    def wait(self, target, timeout):
+        ''' Return the status once target is reached or timeout passed '''
+        deadline = effective_deadline(timeout, target.name)
+        if not self.troubleshooter.is_juju and \
+                hasattr(self.connection, 'exec_command'):
+            return self._stream(target, deadline)
+        reached, status = self.poll(target)
+        if reached:
+            return status
+        return self._poll_until(target, deadline, status)
+
+    def query(self, target, timeout):
+        ''' Current status of target, retrying with backoff on timeouts '''
+        deadline = effective_deadline(timeout, target.name)
+        reached, status = self.poll(target)
+        delay = attempt = 1
+        while status is None and not deadline.expired():
+            time.sleep(min(delay, deadline.remaining()))
+            delay = min(delay * 2, self.MAX_DELAY)
+            reached, status = self.poll(target, attempt)
+            attempt += 1
+        return status
+
+    def poll(self, target, attempt=0):
+        ''' One check of target, attempt counts the checks before it '''
+        ts = self.troubleshooter
+        transport = 'juju' if ts.is_juju else 'ssh'
+        with ts.tracer.span('poll', target.command,
+                            ts._trace_target(self.connection), transport,
+                            attempt) as span:
+            try:
+                out, err = ts._execute_command(self.connection,
+                                               target.command,
+                                               is_juju=ts.is_juju,
+                                               seconds=ts.COMMAND_TIMEOUT)
+                ts._get_eof(out, target.command)
+                reached, status = target.check(MyStr(out).read())
+                self.reached = reached
+            except (TimeoutError, ValueError, KeyError) as err:
+                span.outcome = 'timeout' if isinstance(err, TimeoutError) \
+                    else 'error'
+                scope = current_deadline()
+                if scope is not None and scope.expired():
+                    # the time of the enclosing step is up, not this poll's
+                    raise scope.error()
+                print 'retrying status'
+                return False, None
+            span.outcome = 'ok' if reached else 'not_reached'
+        print status
+        return reached, status
+
+    def _poll_until(self, target, deadline, status, attempt=1):
+        delay = 1
+        while not deadline.expired():
+            time.sleep(min(delay, deadline.remaining()))
+            delay = min(delay * 2, self.MAX_DELAY)
+            reached, new_status = self.poll(target, attempt)
+            attempt += 1
+            status = status if new_status is None else new_status
+            if reached:
+                break
+        return status
+
+    def _stream(self, target, deadline):
+        try:
+            stdin, stdout, stderr = self.connection.exec_command(
+                self.STREAM_COMMAND, get_pty=True)
+        except Exception:
+            stdout = None
+
+        # The stream is opened first so no transition after this poll can
+        # be missed
+        reached, status = self.poll(target)
+        if reached:
+            if stdout is not None:
+                stdout.channel.close()
+            return status
+        if stdout is None:
+            return self._poll_until(target, deadline, status)
+
+        channel = stdout.channel
+        buf = ''
+        last_poll = time.time()
+        attempt = 1
+        try:
+            while not deadline.expired():
+                channel.settimeout(max(min(deadline.remaining(), 1.0), 0.1))
+                try:
+                    data = channel.recv(4096)
+                except socket.timeout:
+                    data = None
+                if data == '':
+                    # ceph -w is not usable here, fall back to polling
+                    return self._poll_until(target, deadline, status,
+                                            attempt)
+                lines = (buf + (data or '')).split('\n')
+                buf = lines.pop()
+                triggered = any(target.trigger.search(l) for l in lines)
+                # quiet clusters log little, re-check now and then anyway
+                if triggered or time.time() - last_poll > 3 * self.MAX_DELAY:
+                    last_poll = time.time()
+                    reached, new_status = self.poll(target, attempt)
+                    attempt += 1
+                    status = status if new_status is None else new_status
+                    if reached:
+                        break
+        finally:
+            channel.close()
+        return status
@@ -1,19 +1,39 @@
+import hashlib
 import json
 import optparse
 import os
 import paramiko
 import re
-import subprocess
+import socket
 import sys
+import tempfile
+import threading
+import time
+from StringIO import StringIO
 
 from helpers.exceptions import (SSHCredsNotFoundError, ConnectionFailedError,
                                 TimeoutError, InitSystemNotSupportedError,
                                 JujuInstallationNotFoundError)
+from helpers.connection_pool import ConnectionPool
+from helpers.deadline import (communicate, deadline_scope,
+                              effective_deadline, kill, spawn)
 from helpers.decorators import timeout
-from helpers.helpers import MyStr
+from helpers.discovery_cache import DiscoveryCache
+from executor import CommandStream, RemoteExecutor
+from health import HealthReport
+from helpers.helpers import MyStr, run_in_parallel
+from helpers.json_stream import JsonStream
+from helpers.tracing import Span, Tracer
+from registry import MachineRegistry
+from remediation import ACTIONS, RemediationOutcome, RemediationPolicy
+from restart_scheduler import RestartScheduler
+from status_watcher import StatusWatcher, health_ok
 
 
 class JujuCephMachine(object):
+    __slots__ = ('name', 'id', 'public_addr', 'hostname', 'has_osd',
+                 'has_mon', 'internal_ip')
+
     def __init__(self, name, id, public_addr, hostname, has_osd=False,
                  has_mon=False, internal_ip=None):
         self.name = name
@@ -24,6 +44,9 @@ class JujuCephMachine(object):
         self.has_mon = has_mon
         self.internal_ip = internal_ip
 
+    def as_dict(self):
+        return dict((field, getattr(self, field)) for field in self.__slots__)
+
 
 class TroubleshootCeph(object):
     '''
@@ -32,21 +55,49 @@ class TroubleshootCeph(object):
     GOOD_HEALTH = ['HEALTH_OK']
     BAD_HEALTH = ['HEALTH_WARN']
     CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
-    init_script = CURRENT_DIR + '/scripts/check_init.sh'
-    arch_script = CURRENT_DIR + '/scripts/find_processor_architecture.sh'
-
-    def __init__(self):
+    probe_script = CURRENT_DIR + '/scripts/probe_host_facts.sh'
+    host_facts = {}
+    pool = None
+    health_report = None
+    registry = None
+    COMMAND_TIMEOUT = 10
+    JUJU_APPLICATIONS = ('ceph', 'ceph-osd')
+    # Answers ssh connections and local commands instead of the network
+    # when set, see replay.ReplayTransport
+    transport = None
+    tracer = Tracer()
+
+    # Per cluster state set while diagnosing, see reset_session()
+    SESSION_ATTRIBUTES = ('options', 'arguments', 'connection', 'juju_version',
+                          'timeout', 'advance', 'cli_down', 'is_juju',
+                          'juju_ceph_machines', 'init_type', 'arch_type',
+                          'pem_location', 'cache', 'cached', 'policy',
+                          'outcome')
+
+    def __init__(self, args=None):
         self.parser = self._get_opt_parser()
         cls = TroubleshootCeph
-        cls.options, cls.arguments = self.parser.parse_args()
+        cls.options, cls.arguments = self.parser.parse_args(args)
         cls.juju_version = None
         cls.timeout = cls.options.timeout
         cls.advance = cls.options.advance
+        if cls.options.trace != cls.tracer.path:
+            cls.tracer.close()
+            cls.tracer = Tracer(cls.options.trace)
         if not hasattr(cls, 'cli_down'):
             cls.cli_down = False
+        if cls.registry is None:
+            cls.registry = MachineRegistry()
+        if not hasattr(cls, 'policy'):
+            cls.policy = RemediationPolicy.from_options(cls.options)
+            cls.outcome = RemediationOutcome()
 
         if cls.options.provider == 'juju':
-            cls.juju_version = self._find_juju_version()
+            self._init_discovery_cache()
+            if cls.cached is not None:
+                cls.juju_version = cls.cached.get('juju_version')
+            if cls.juju_version is None:
+                cls.juju_version = self._find_juju_version()
         elif (not (cls.options.host and cls.options.user) and
               not (cls.options.host and cls.options.ssh_key and
                    cls.options.user)):
@@ -65,6 +116,19 @@ class TroubleshootCeph(object):
 
         self._init_common_variables()
 
+    @classmethod
+    def reset_session(cls):
+        ''' Forget all state of the current cluster '''
+        if cls.pool is not None:
+            cls.pool.close_all()
+        for attr in cls.SESSION_ATTRIBUTES:
+            if attr in TroubleshootCeph.__dict__:
+                delattr(TroubleshootCeph, attr)
+        TroubleshootCeph.host_facts = {}
+        TroubleshootCeph.pool = None
+        TroubleshootCeph.health_report = None
+        TroubleshootCeph.registry = None
+
     def _init_ssh_variables(self):
         cls = TroubleshootCeph
         if not hasattr(cls, 'is_juju'):
@@ -74,6 +138,21 @@ class TroubleshootCeph(object):
         except Exception:
             raise ConnectionFailedError('Couldnot connect to host')
 
+    def _init_discovery_cache(self):
+        cls = TroubleshootCeph
+        if hasattr(cls, 'cache'):
+            return
+        # one cache file per juju model so models never evict each other
+        model = os.environ.get('JUJU_MODEL', os.environ.get('JUJU_ENV'))
+        name = 'discovery.json' if not model else \
+            'discovery-' + model.replace('/', '_') + '.json'
+        path = os.path.join(os.path.expanduser('~'), '.cache/diagnose_ceph',
+                            name)
+        cls.cache = DiscoveryCache(path, cls.options.cache_ttl)
+        if cls.options.refresh:
+            cls.cache.invalidate()
+        cls.cached = cls.cache.load()
+
     def _init_juju_flavor_specific_variables(self):
         cls = TroubleshootCeph
         home = os.path.expanduser('~')
@@ -87,6 +166,7 @@ class TroubleshootCeph(object):
         cls = TroubleshootCeph
         if not hasattr(cls, 'juju_ceph_machines'):
             cls.juju_ceph_machines = self._get_all_juju_ceph_machines()
+            cls.registry = MachineRegistry(cls.juju_ceph_machines)
         if not hasattr(cls, 'is_juju'):
             cls.is_juju = True
 
@@ -104,78 +184,113 @@ class TroubleshootCeph(object):
     def _get_machine_param(self, machine):
         id = machine['machine']
         public_addr = machine['public-address']
-        cmd = 'juju run --machine ' + str(id) + ' "cat /etc/hostname"'
-        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
-
-        hostname = proc.communicate()[0].strip('\n')
-        cmd = 'juju run --machine ' + str(id) + ' "host ' + hostname + ' "'
-        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
-        i_ip = proc.communicate()[0].strip('\n').split(' ')[-1]
+        facts = self._get_host_facts(JujuCephMachine(None, id, public_addr,
+                                                     None), juju=True)
+        return id, public_addr, facts['hostname'], facts['internal_ip']
 
-        return id, public_addr, hostname, i_ip
+    def _discover_unit(self, unit):
+        ''' Fetch machine params of a juju unit, timing the lookup '''
+        start = time.time()
+        try:
+            params = self._get_machine_param(unit)
+        except (ValueError, KeyError, TimeoutError):
+            params = None
+        return params, time.time() - start
 
     def _get_all_juju_ceph_machines(self):
         cls = TroubleshootCeph
         leader_id = sys.maxint
         cls.connection = None
 
-        proc = subprocess.Popen('juju status --format json', shell=True,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
+        # Only the ceph applications are asked for, and only their units
+        # are parsed out of the output as it streams in
+        ceph_mon, ceph_osd = {}, {}
         try:
-            machine_list = json.loads(proc.communicate()[0])
-        except ValueError:
+            with cls._open_local('juju status --format json ' +
+                                 ' '.join(cls.JUJU_APPLICATIONS)) as stream:
+                for trail, (name, unit) in JsonStream(stream).items(
+                        [('applications', 'services'), cls.JUJU_APPLICATIONS,
+                         ('units',)]):
+                    units = ceph_mon if trail[1] == 'ceph' else ceph_osd
+                    units[name] = dict((field, unit.get(field)) for field
+                                       in ('machine', 'public-address'))
+        except (TimeoutError, ValueError):
             print 'Could not fetch machines from juju cli, aborting'
             exit()
 
         juju_machines = []
 
-        ceph_mon = machine_list['services']['ceph']['units']
-        ceph_mon = {} if ceph_mon is None else ceph_mon
-
-        for name, val in ceph_mon.iteritems():
-            jujuname = name
-            try:
-                id, public_addr, hostname, i_ip = self._get_machine_param(val)
-            except ValueError:
+        # (jujuname, unit, is_mon) for every unit, mons first
+        units = [(name, val, True) for name, val in ceph_mon.iteritems()]
+        units += [(name, val, False) for name, val in ceph_osd.iteritems()]
+
+        status_hash = self._hash_units(units)
+        if cls.cached is not None and \
+                cls.cached.get('status_hash') == status_hash:
+            print 'Using cached discovery, pass --refresh to rediscover'
+            return self._load_cached_machines(cls.cached)
+
+        # One batched probe for every unit, units it could not answer for
+        # are retried on their own in parallel
+        start = time.time()
+        self._prefetch_host_facts([JujuCephMachine(None, val['machine'],
+                                                   val['public-address'],
+                                                   None)
+                                   for name, val, is_mon in units])
+        print 'Probed', len(units), 'units in %.2fs' % (time.time() - start)
+
+        results = run_in_parallel(lambda unit: self._discover_unit(unit[1]),
+                                  units, cls.options.workers)
+
+        for (jujuname, val, is_mon), (params, elapsed) in zip(units, results):
+            if params is None:
                 print 'Could not fetch details for ', val
-            else:
-                machine = JujuCephMachine(jujuname, id, public_addr, hostname,
-                                          has_mon=True, internal_ip=i_ip)
-
-                if int(id) < leader_id:
-                    leader_id, cls.connection = int(id), machine
-
-                juju_machines.append(machine)
-                print 'Found - ', hostname, '-', jujuname, '-', public_addr,
-                print '-', i_ip
+                continue
+
+            id, public_addr, hostname, i_ip = params
+            machine = JujuCephMachine(jujuname, id, public_addr, hostname,
+                                      has_osd=not is_mon, has_mon=is_mon,
+                                      internal_ip=i_ip)
+
+            if is_mon and int(id) < leader_id:
+                leader_id, cls.connection = int(id), machine
+
+            juju_machines.append(machine)
+            print 'Found - ', hostname, '-', jujuname, '-', public_addr,
+            print '-', i_ip, '(%.2fs)' % elapsed
+
+        cls.cache.save({
+            'juju_version': cls.juju_version,
+            'status_hash': status_hash,
+            'machines': [m.as_dict() for m in juju_machines],
+            'host_facts': dict((key, facts) for key, facts
+                               in cls.host_facts.iteritems()
+                               if key.startswith('juju-')),
+        })
+        return juju_machines
 
-        ceph_osd = machine_list['services']['ceph-osd']['units']
-        ceph_osd = {} if ceph_osd is None else ceph_osd
-
-        for name, val in ceph_osd.iteritems():
-            jujuname = name
-            try:
-                id, public_addr, hostname, i_ip = self._get_machine_param(val)
-            except ValueError:
-                print 'Could not fetch details for ', val
-            else:
-                machine = JujuCephMachine(jujuname, id, public_addr, hostname,
-                                          has_osd=True, internal_ip=i_ip)
-                juju_machines.append(machine)
-                print 'Found - ', hostname, '-', jujuname, '-', public_addr,
-                print '-', i_ip
+    def _hash_units(self, units):
+        ''' Digest of the ceph unit/machine set reported by juju status '''
+        unit_set = sorted([name, str(val.get('machine')),
+                           val.get('public-address')]
+                          for name, val, is_mon in units)
+        return hashlib.sha1(json.dumps(unit_set)).hexdigest()
 
+    def _load_cached_machines(self, cached):
+        cls = TroubleshootCeph
+        juju_machines = [JujuCephMachine(**m) for m in cached['machines']]
+        mons = [m for m in juju_machines if m.has_mon]
+        if mons:
+            cls.connection = min(mons, key=lambda m: int(m.id))
+        cls.host_facts.update(cached.get('host_facts', {}))
+        for machine in juju_machines:
+            print 'Found - ', machine.hostname, '-', machine.name, '-',
+            print machine.public_addr, '-', machine.internal_ip, '(cached)'
         return juju_machines
 
     def _find_juju_version(self):
-        proc = subprocess.Popen('juju --version', shell=True,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
         try:
-            stdout = proc.communicate()[0].strip('\n')
+            stdout = self._run_local('juju --version')[0].strip('\n')
         except ValueError:
             print ' Could not get juju version, aborting'
             exit()
@@ -186,15 +301,49 @@ class TroubleshootCeph(object):
             return 'juju1'
         return 'not_supported'
 
+    @classmethod
+    def _facts_key(cls, connection):
+        if hasattr(connection, 'get_transport'):
+            return 'ssh-' + connection.get_transport().getpeername()[0]
+        return 'juju-' + str(connection.id)
+
+    @classmethod
+    def _get_host_facts(cls, connection=None, juju=False):
+        '''
+            Run the bundled probe script once per host and cache what it
+            reports: init_type, arch_type, hostname, internal_ip and the
+            entries of /var/run/ceph (sockets).
+        '''
+        key = cls._facts_key(connection)
+        if key not in cls.host_facts:
+            cmd = open(cls.probe_script, 'r').read()
+            out, err = cls._execute_command(connection, cmd, juju)
+            cls.host_facts[key] = json.loads(MyStr(out).read())
+        return cls.host_facts[key]
+
+    @classmethod
+    def _prefetch_host_facts(cls, targets):
+        ''' Probe every uncached juju target with a single juju run '''
+        pending = [target for target in targets
+                   if cls._facts_key(target) not in cls.host_facts]
+        if not pending:
+            return
+        cmd = open(cls.probe_script, 'r').read()
+        try:
+            results = cls._execute_juju_batch(pending, cmd)
+        except TimeoutError:
+            return
+        for target, (out, err, code) in results.iteritems():
+            try:
+                cls.host_facts[cls._facts_key(target)] = json.loads(out)
+            except ValueError:
+                pass  # probed again on its own by _get_host_facts
+
     def _get_init_type(self, connection=None, juju=False):
-        cmd = open(self.init_script, 'r').read()
-        out, err = self._execute_command(connection, cmd, juju)
-        return MyStr(out).read()
+        return self._get_host_facts(connection, juju)['init_type']
 
     def _get_arch_type(self, connection=None, juju=False):
-        cmd = open(self.arch_script, 'r').read()
-        out, err = self._execute_command(connection, cmd, juju)
-        return MyStr(out).read()
+        return self._get_host_facts(connection, juju)['arch_type']
 
     def _get_opt_parser(self):
         desc = ('Command line parser for CephDiagnoseTool \n'
@@ -214,43 +363,360 @@ class TroubleshootCeph(object):
         parser.add_option('-t', '--timeout', dest='timeout', default=30)
         parser.add_option('-a', '--advance', action='store_true',
                           dest='advance', default=False)
+        parser.add_option('-w', '--workers', dest='workers', type='int',
+                          default=16,
+                          help='max concurrent remote calls during discovery')
+        parser.add_option('-m', '--max-connections', dest='max_connections',
+                          type='int', default=64,
+                          help='max hosts kept connected over ssh')
+        parser.add_option('--cache-ttl', dest='cache_ttl', type='int',
+                          default=300,
+                          help='seconds juju discovery results are reused, '
+                               '0 disables the cache')
+        parser.add_option('--refresh', action='store_true', dest='refresh',
+                          default=False,
+                          help='ignore cached juju discovery results')
+        parser.add_option('--restart-concurrency', dest='restart_concurrency',
+                          type='int', default=4,
+                          help='max daemons restarted at the same time')
+        parser.add_option('--restart-per-host', dest='restart_per_host',
+                          type='int', default=0,
+                          help='max daemons restarted at once on one host, '
+                               '0 for no limit')
+        parser.add_option('--restart-per-domain', dest='restart_per_domain',
+                          type='int', default=0,
+                          help='max osds restarted at once in one failure '
+                               'domain, 0 for no limit')
+        parser.add_option('--failure-domain', dest='failure_domain',
+                          default='rack',
+                          help='crush bucket type used as failure domain')
+        parser.add_option('--clock-drift', dest='clock_drift', type='float',
+                          default=0.05,
+                          help='seconds a mon clock may be off from the '
+                               'others before ntp is restarted')
+        parser.add_option('--trace', dest='trace', default=None,
+                          help='append a JSON line per remote command, '
+                               'connection and poll to this file')
+        parser.add_option('--policy', dest='policy', default=None,
+                          help='JSON file allowing/denying remediations')
+        parser.add_option('--allow', dest='allow', action='append',
+                          type='choice', choices=ACTIONS, default=[],
+                          help='run this remediation without asking, one '
+                               'of ' + ', '.join(ACTIONS))
+        parser.add_option('--deny', dest='deny', action='append',
+                          type='choice', choices=ACTIONS, default=[],
+                          help='never run this remediation')
+        parser.add_option('--unattended', action='store_true',
+                          dest='unattended', default=False,
+                          help='never prompt, remediations not allowed are '
+                               'skipped')
+        parser.add_option('--step-timeout', dest='step_timeout', type='int',
+                          default=None,
+                          help='seconds a remediation step may take')
+        parser.add_option('--watch', dest='watch', type='int', default=None,
+                          help='keep running, re-checking the cluster every '
+                               'WATCH seconds and reporting what changed')
+        parser.add_option('--outcome', dest='outcome', default=None,
+                          help='write the steps taken and the result as '
+                               'JSON to this file at exit')
         return parser
 
     @classmethod
     def _get_connection(cls, hostname):
+        if cls.pool is None:
+            cls.pool = ConnectionPool(cls._open_connection,
+                                      cls.options.max_connections)
+        return cls.pool.get(hostname)
+
+    @classmethod
+    def _open_connection(cls, hostname):
         client = paramiko.SSHClient()
         client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        if cls.options.ssh_key is None:
-            client.connect(hostname=hostname, username=cls.options.user,
-                           password=cls.options.password)
-        else:
-            k = paramiko.RSAKey.from_private_key_file(cls.options.ssh_key)
-            client.connect(hostname=hostname, username=cls.options.user,
-                           pkey=k)
+        with cls.tracer.span('connect', target=hostname, transport='ssh'):
+            try:
+                if cls.transport is not None:
+                    return cls.transport.connect(hostname)
+                elif cls.options.ssh_key is None:
+                    client.connect(hostname=hostname,
+                                   username=cls.options.user,
+                                   password=cls.options.password)
+                else:
+                    k = paramiko.RSAKey.from_private_key_file(
+                        cls.options.ssh_key)
+                    client.connect(hostname=hostname,
+                                   username=cls.options.user, pkey=k)
+            except (paramiko.SSHException, socket.error) as err:
+                raise ConnectionFailedError('Could not connect to ' +
+                                            hostname + ': ' + str(err))
         return client
 
     @classmethod
-    def _execute_juju_command(cls, connection, command):
-            from base64 import b64encode
-            command = '`echo ' + b64encode(command) + ' | base64 --decode`'
-            cmd = 'juju run --machine ' + str(connection.id) + ' --timeout '
-            cmd += str(cls.timeout) + 's' + ' "' + command + '"'
-            out = subprocess.Popen(cmd, shell=True,
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
-            return out.communicate()
+    def report_connection_stats(cls):
+        if cls.pool is None:
+            return
+        msg = ('ssh connection pool: %(hits)d hits, %(misses)d misses, '
+               '%(reconnects)d reconnects, %(open)d open')
+        print msg % cls.pool.stats()
 
     @classmethod
-    def _execute_command(cls, connection, command, is_juju=False):
-        if is_juju is True:
-            (out, err) = cls._execute_juju_command(connection, command)
+    def report_trace(cls, top=10):
+        ''' Print the top time consumers among the traced spans '''
+        cls.tracer.close()
+        rows = cls.tracer.summary(top)
+        if not rows:
+            return
+        print '\n%-10s %-48s %6s %9s %8s %6s' % (
+            'kind', 'command', 'count', 'total', 'max', 'not ok')
+        for kind, label, count, total, longest, failed in rows:
+            print '%-10s %-48s %6d %8.2fs %7.2fs %6d' % (
+                kind, label, count, total, longest, failed)
+        if cls.tracer.path is not None:
+            print 'full trace written to', cls.tracer.path
+
+    @classmethod
+    def _trace_target(cls, connection):
+        ''' Host or juju machine a connection runs commands on '''
+        if hasattr(connection, 'get_transport'):
+            try:
+                return connection.get_transport().getpeername()[0]
+            except (AttributeError, socket.error):
+                return None
+        return 'machine ' + str(getattr(connection, 'id', None))
+
+    @classmethod
+    def _juju_run_cmd(cls, connection, command):
+        from base64 import b64encode
+        command = '`echo ' + b64encode(command) + ' | base64 --decode`'
+        cmd = 'juju run --machine ' + str(connection.id) + ' --timeout '
+        cmd += str(cls.timeout) + 's' + ' "' + command + '"'
+        return cmd
+
+    @classmethod
+    def _execute_juju_command(cls, connection, command, deadline=None):
+        cmd = cls._juju_run_cmd(connection, command)
+        return cls._run_local(cmd, deadline, command)
+
+    @classmethod
+    def _open_local(cls, cmd, deadline=None, command=None, target=None):
+        '''
+            Run cmd in a local shell, returns a CommandStream of its stdout
+            to be read as the output arrives. The process is killed once
+            deadline passes, closing the stream then raises TimeoutError,
+            as it does when juju reports an ERROR.
+        '''
+        command = cmd if command is None else command
+        span = Span('exec', command, target,
+                    'local' if target is None else 'juju')
+        killed = []
+        if cls.transport is not None:
+            try:
+                out, err = cls.transport.run_local(cmd, deadline, command)
+            except TimeoutError:
+                span.outcome, span.duration = 'timeout', 0.0
+                cls.tracer.record(span)
+                raise
+            stdout = StringIO(out)
+
+            def wait():
+                return 0, err
+        else:
+            errors = tempfile.TemporaryFile()
+            proc = spawn(cmd, stderr=errors)
+            stdout = proc.stdout
+            timer = None
+            if deadline is not None:
+                timer = threading.Timer(deadline.remaining(),
+                                        lambda: killed.append(kill(proc)))
+                timer.daemon = True
+                timer.start()
+
+            def wait():
+                # a reader stopping early gets the process a SIGPIPE
+                stdout.close()
+                status = proc.wait()
+                if timer is not None:
+                    timer.cancel()
+                errors.seek(0)
+                err = errors.read()
+                errors.close()
+                return status, err
+
+        def finish(size):
+            status, err = wait()
+            span.duration = time.time() - span.start
+            span.bytes = size + len(err)
+            if killed or err.startswith('ERROR'):
+                span.outcome = 'timeout'
+            elif status != 0:
+                span.outcome = 'failed'
+            cls.tracer.record(span)
+            if killed:
+                raise deadline.error(command)
             if err.startswith('ERROR'):
                 raise TimeoutError(command + ' timed out')
+
+        return CommandStream(stdout, finish)
+
+    @classmethod
+    def _stream_command(cls, connection, command, is_juju=False,
+                        seconds=None):
+        '''
+            Run command on connection, returns a CommandStream of its
+            stdout to be read in a with block.
+        '''
+        if is_juju is not True:
+            out, err = cls._execute_command(connection, command, is_juju,
+                                            seconds)
+            return CommandStream(out, lambda size: cls._get_eof(out,
+                                                                command))
+        return cls._open_local(cls._juju_run_cmd(connection, command),
+                               effective_deadline(seconds, command), command,
+                               cls._trace_target(connection))
+
+    @classmethod
+    def _spawn_local(cls, cmd):
+        ''' Start cmd in a local shell, or in the replay transport if set '''
+        if cls.transport is not None:
+            return cls.transport.spawn_local(cmd)
+        return spawn(cmd)
+
+    @classmethod
+    def _run_local(cls, cmd, deadline=None, command=None):
+        ''' Run cmd in a local shell, returns (stdout, stderr) '''
+        if cls.transport is not None:
+            return cls.transport.run_local(cmd, deadline, command)
+        return communicate(spawn(cmd), deadline, command)
+
+    @classmethod
+    def gather(cls, jobs, seconds=None):
+        '''
+            Run all (connection, command) pairs of jobs concurrently, at
+            most options.workers at a time, each bounded by seconds.
+
+            Returns:
+                list: CommandResult for every job, in order.
+        '''
+        deadline = effective_deadline(seconds)
+        if deadline is not None:
+            seconds = deadline.remaining()
+        executor = RemoteExecutor(cls._juju_run_cmd, cls.options.workers,
+                                  cls._spawn_local)
+        results = executor.gather(jobs, cls.is_juju, seconds)
+        for result in results:
+            if result.ok:
+                outcome = 'ok'
             else:
-                return (out, err)
-        else:
-            (stdin, stdout, stderr) = connection.exec_command(command)
-            return (stdout, stderr)
+                outcome = 'timeout' if result.exit_status is None else 'failed'
+            cls.tracer.record(Span('gather', result.command,
+                                   cls._trace_target(result.target),
+                                   'juju' if cls.is_juju else 'ssh',
+                                   result.started, result.duration,
+                                   len(result.stdout) + len(result.stderr),
+                                   outcome))
+        return results
+
+    @classmethod
+    def _execute_juju_batch(cls, targets, command, seconds=None):
+        '''
+            Run command on all targets (JujuCephMachine, MonObject, OsdObject
+            or anything else with a juju machine id) with a single juju run.
+
+            Returns:
+                dict: target -> (stdout, stderr, exit_code). Targets living
+                    on the same machine share that machine's result, the
+                    exit code is None for machines juju did not report on
+                    or reported an Error for.
+        '''
+        from base64 import b64encode
+        targets = list(targets)
+        if not targets:
+            return {}
+        machine_ids = []
+        for target in targets:
+            if str(target.id) not in machine_ids:
+                machine_ids.append(str(target.id))
+
+        encoded = '`echo ' + b64encode(command) + ' | base64 --decode`'
+        cmd = 'juju run --format json --machine ' + ','.join(machine_ids)
+        cmd += ' --timeout ' + str(cls.timeout) + 's' + ' "' + encoded + '"'
+        with cls.tracer.span('juju_batch', command,
+                             'machines ' + ','.join(machine_ids),
+                             'juju') as span:
+            out, err = cls._run_local(cmd,
+                                      effective_deadline(seconds, command),
+                                      command)
+            span.bytes = len(out) + len(err)
+            if err.startswith('ERROR'):
+                raise TimeoutError(command + ' timed out')
+
+        try:
+            machine_results = json.loads(out)
+        except ValueError:
+            machine_results = []
+
+        by_machine = {}
+        for result in machine_results:
+            # juju leaves a ReturnCode of 0 out, an Error without one(ex a
+            # unit timeout) means the command never finished
+            code = result.get('ReturnCode')
+            if code is None and 'Error' not in result:
+                code = 0
+            by_machine[str(result.get('MachineId'))] = (
+                result.get('Stdout', ''),
+                result.get('Stderr', result.get('Error', '')), code)
+
+        missing = ('', 'no result from juju run', None)
+        return dict((target, by_machine.get(str(target.id), missing))
+                    for target in targets)
+
+    @classmethod
+    def _execute_command(cls, connection, command, is_juju=False,
+                         seconds=None):
+        '''
+            Run command on connection. seconds bounds this call only, the
+            deadline of an enclosing timeout() scope of the calling thread
+            applies as well.
+        '''
+        deadline = effective_deadline(seconds, command)
+        transport = 'juju' if is_juju is True else 'ssh'
+        with cls.tracer.span('exec', command, cls._trace_target(connection),
+                             transport) as span:
+            if is_juju is True:
+                (out, err) = cls._execute_juju_command(connection, command,
+                                                       deadline)
+                span.bytes = len(out) + len(err)
+                if err.startswith('ERROR'):
+                    raise TimeoutError(command + ' timed out')
+                else:
+                    return (out, err)
+            else:
+                # the output is read by the caller, _get_eof times the wait
+                if deadline is not None:
+                    deadline.check(command)
+                    (stdin, stdout, stderr) = connection.exec_command(
+                        command, timeout=max(deadline.remaining(), 0.1))
+                else:
+                    (stdin, stdout, stderr) = connection.exec_command(command)
+                return (stdout, stderr)
+
+    @classmethod
+    def _execute_with_status(cls, connection, command, is_juju=False,
+                             seconds=None):
+        '''
+            Run command on connection and wait for it to finish. Over juju
+            this is a --format json run, the only one reporting the exit
+            code of the command.
+
+            Returns:
+                tuple: (stdout, stderr, exit_status), exit_status is None
+                    when juju did not report on the machine.
+        '''
+        if is_juju is True:
+            return cls._execute_juju_batch([connection], command,
+                                           seconds)[connection]
+        out, err = cls._execute_command(connection, command, is_juju, seconds)
+        status = cls._exit_status(out, command)
+        return MyStr(out).read(), MyStr(err).read(), status
 
     @classmethod
     def _init_cli_down(cls):
@@ -261,13 +727,10 @@ class TroubleshootCeph(object):
 
     def start_troubleshoot(self):
         cls = TroubleshootCeph
-        command = 'sudo ceph health'
         cluster_status = None
         try:
-            (output, err) = cls._execute_command(cls.connection, command,
-                                                 is_juju=cls.is_juju)
-            cls._get_eof(output, command)
-            cluster_status = MyStr(output).read().split(' ')[0].strip()
+            cluster_status = cls.get_health_report(cls.connection,
+                                                   refresh=True).status
         except TimeoutError as err:
             # ceph cli is not working i.e. quorum is not being established
             # hence we need to use ceph admin sockets
@@ -277,9 +740,7 @@ class TroubleshootCeph(object):
             print 'Currently this requires vanilla installation of juju(with ',
             print 'ssh keys are default location and user named ubuntu).'
 
-            print '(yes/no) (default yes)?',
-            response = raw_input()
-            if response == 'yes' or response == '':
+            if cls.approve('ssh_fallback', 'Switch to ssh', default=True):
                 print 'proceeding ',
                 for i in range(20):
                     sys.stdout.write('.')
@@ -288,13 +749,109 @@ class TroubleshootCeph(object):
             else:
                 exit()
             return None
+        cls.outcome.status = cluster_status
         return cluster_status
 
+    @classmethod
+    def approve(cls, action, question, default=False):
+        '''
+            Whether remediation action may run, as decided by the policy or
+            else by the user. The decision is added to the outcome.
+        '''
+        decision = cls.policy.decide(action)
+        print question, '(yes/no) (default %s)?' % ('yes' if default
+                                                    else 'no'),
+        if decision == 'ask':
+            try:
+                response = raw_input()
+            except EOFError:
+                response = ''
+            approved = response == 'yes' or (default and response == '')
+        else:
+            approved = decision == 'allow'
+            print ('yes' if approved else 'no'), '(policy)'
+        cls.outcome.add_step(action, decision, approved)
+        return approved
+
+    def _remediate(self, action, question, func, target=None,
+                   default=False):
+        '''
+            Ask for/check approval of action, then run func and wait for
+            target (HEALTH_OK when None), all within the step timeout of
+            the policy. func returns whether it succeeded, the step fails
+            when it did not and is unresolved when target is not reached.
+
+            Returns:
+                tuple: (approved, status seen afterwards), the status is
+                    None when the step timed out or failed.
+        '''
+        if not self.approve(action, question, default):
+            return False, None
+        step = self.outcome.steps[-1]
+        start = time.time()
+        status = None
+        try:
+            with deadline_scope(self.policy.timeout(action) or None,
+                                action) as deadline:
+                succeeded = func()
+                if target is None:
+                    status = self.poll_ceph_status(self.connection)
+                    reached = status == 'HEALTH_OK'
+                else:
+                    watcher = StatusWatcher(self, self.connection)
+                    status = watcher.wait(target, int(self.options.timeout))
+                    reached = watcher.reached
+                if deadline is not None and deadline.expired():
+                    raise deadline.error(action)
+            if not succeeded:
+                step['result'] = 'failed'
+            else:
+                step['result'] = 'ok' if reached else 'unresolved'
+        except TimeoutError as err:
+            print action, 'did not finish in time:', err
+            status = None
+            step['result'], step['error'] = 'timeout', str(err)
+        except Exception as err:
+            print action, 'failed:', err
+            step['result'], step['error'] = 'error', str(err)
+        step['duration'] = time.time() - start
+        step['status'] = status
+        if status is not None:
+            self.outcome.status = status
+        return True, status
+
+    @classmethod
+    def report_outcome(cls):
+        ''' Save the outcome to the --outcome file, if any '''
+        if hasattr(cls, 'outcome') and cls.options.outcome is not None:
+            cls.outcome.save(cls.options.outcome)
+
+    @classmethod
+    def get_health_report(cls, connection, refresh=False):
+        '''
+            HealthReport of the current diagnosis pass. The health command
+            only runs again when refresh is set or after a remediation
+            step invalidated the report.
+        '''
+        if refresh or cls.health_report is None:
+            command = HealthReport.COMMAND
+            (output, err) = cls._execute_command(connection, command,
+                                                 is_juju=cls.is_juju)
+            cls._get_eof(output, command)
+            output = MyStr(output).read()
+            try:
+                cls.health_report = HealthReport.from_json(output)
+            except (ValueError, KeyError):
+                cls.health_report = HealthReport(
+                    output.split(' ')[0].strip(), [])
+        return cls.health_report
+
     @classmethod
     @timeout(10)
     def check_ceph_cli_health(cls, connection, command='sudo ceph health'):
         (output, err) = cls._execute_command(connection, command,
                                              is_juju=cls.is_juju)
+        cls._get_eof(output, command)
         status = MyStr(output).read().split(' ')[0].strip()
 
         if status == 'HEALTH_OK':
@@ -304,28 +861,45 @@ class TroubleshootCeph(object):
             print "Didn't work, trying deeper probe"
 
     @classmethod
-    @timeout(10)
-    def _get_eof(cls, stream, command):
+    def _get_eof(cls, stream, command, seconds=None):
+        '''
+            Block until the remote command behind stream finishes, sleeping
+            on the channel status event instead of spinning. Raises
+            TimeoutError once the per command deadline has passed.
+        '''
         if isinstance(stream, basestring):
             return
-        while not stream.channel.eof_received:
-            pass
-        return stream.channel.eof_received
+        if seconds is None:
+            seconds = cls.COMMAND_TIMEOUT
+        channel = stream.channel
+        deadline = effective_deadline(seconds, command)
+        with cls.tracer.span('eof_wait', command, transport='ssh'):
+            while not (channel.eof_received or channel.exit_status_ready()):
+                deadline.check(command)
+                # status_event fires on exit status or close, eof alone is
+                # picked up on the next wakeup
+                channel.status_event.wait(min(deadline.remaining(), 0.5))
+        return True
+
+    @classmethod
+    def _exit_status(cls, stream, command):
+        ''' Exit status of the command behind stream, None if unknown '''
+        if isinstance(stream, basestring):
+            return None
+        cls._get_eof(stream, command)
+        return stream.channel.recv_exit_status()
+
+    def _get_restart_scheduler(self, restart, check):
+        return RestartScheduler(restart, check,
+                                self.options.restart_concurrency,
+                                self.options.restart_per_host,
+                                self.options.restart_per_domain,
+                                verify_timeout=int(self.options.timeout))
 
     @classmethod
     def poll_ceph_status(cls, connection, command='sudo ceph health'):
-        tries = int(cls.options.timeout) / 10
-        status = None
-        for i in range(tries):
-            (out, err) = cls._execute_command(connection, command,
-                                              is_juju=cls.is_juju)
-            try:
-                cls._get_eof(out, command)
-            except TimeoutError:
-                print 'retrying status'
-            else:
-                status = MyStr(out).read().split(' ')[0].strip()
-                print status
-                if status == 'HEALTH_OK':
-                    return status
-        return status
+        ''' Wait up to options.timeout seconds for HEALTH_OK '''
+        # the cluster changed since the last report was fetched
+        cls.health_report = None
+        watcher = StatusWatcher(cls, connection)
+        return watcher.wait(health_ok(command), int(cls.options.timeout))
@@ -1,10 +1,18 @@
 from ConfigParser import ConfigParser
+import hashlib
 import os
-import subprocess
 import re
 
-from helpers.exceptions import ConnectionFailedError, TimeoutError
-from helpers.helpers import MyStr
+from clock_probe import ClockProbe
+from helpers.deadline import (current_deadline, deadline_scope,
+                              effective_deadline)
+from helpers.exceptions import (ConnectionFailedError,
+                                QuorumIssueNotResolvedError, TimeoutError)
+from helpers.helpers import MyStr, run_in_parallel
+from mon_status import MonStatus
+from reachability import ReachabilityMatrix
+from restart_scheduler import RestartJob, RestartScheduler
+from status_watcher import StatusWatcher, mons_in_quorum
 from troubleshoot_ceph import TroubleshootCeph
 
 
@@ -29,7 +37,11 @@ class MonObject(object):
             **kwargs (dict): Additional parameters required when object is
                 initialized using juju_machine method. Juju cli requires an
                 additional id attribute and juju machine_name attribute.
+                Only the juju fields listed in __slots__ are accepted.
     """
+    __slots__ = ('host', 'admin_socket', 'connection', 'ssh_status', 'mon_id',
+                 'is_monmap_correct', 'juju_id', 'juju_name', 'hostname',
+                 'public_addr')
 
     def __init__(self, host, ssh_status, connection=None, admin_socket=None,
                  **kwargs):
@@ -39,6 +51,8 @@ class MonObject(object):
         self.ssh_status = ssh_status
         self.mon_id = None if admin_socket is None else admin_socket[9:-5]
         self.is_monmap_correct = False
+        self.juju_id = self.juju_name = None
+        self.hostname = self.public_addr = None
         if 'juju_id' in kwargs:
             self.connection = self
         if 'hostname' in kwargs:
@@ -51,7 +65,8 @@ class MonObject(object):
                      juju_id):
         return cls(host=public_addr, ssh_status='LIVE', connection=None,
                    admin_socket=admin_socket, juju_id=juju_id,
-                   juju_name=juju_name, hostname=hostname)
+                   juju_name=juju_name, hostname=hostname,
+                   public_addr=public_addr)
 
     @property
     def id(self):
@@ -72,6 +87,8 @@ class TroubleshootCephMon(TroubleshootCeph):
             self.machines = self._get_juju_machine_objects()
         else:
             self.machines = self._get_machine_objects()
+        for machine in self.machines:
+            self.registry.add_mon(machine)
 
         if self.is_ceph_cli:
             self._troubleshoot_mon_cli()
@@ -91,27 +108,60 @@ class TroubleshootCephMon(TroubleshootCeph):
         # Didnt work try restart all mon machines
 
         print '\nProbable cause Ceph mon service not running in some machines'
-        print 'Try & start the mon service in every machine',
-        print '(yes/no) (default no)?',
-        response = raw_input()
+        approved, status = self._remediate(
+            'restart_mons', 'Try & start the mon service in every machine',
+            self._restart_all_mon_daemons)
 
-        if response != 'yes':
+        if not approved:
             print 'not proceeding with starting machines, aborting'
             return
 
-        self._restart_all_mon_daemons()
-
-        if self.poll_ceph_status(self.connection) == 'HEALTH_OK':
+        if status == 'HEALTH_OK':
             print 'Ceph Cluster working again :-)'
             exit()
         else:
             print "Restarting all mon servers didn't work,"
 
     def _restart_all_mon_daemons(self):
-        for machine in self.machines:
-            if machine.ssh_status == 'LIVE':
-                print 'Restarting machine ' + machine.host
-                self._restart_ceph_mon_service('start', machine.connection)
+        return self._restart_mons([m for m in self.machines
+                                   if m.ssh_status == 'LIVE'])
+
+    def _restart_mons(self, mons):
+        '''
+            Start the mon service on mons in waves and report how it went,
+            returns whether every mon came up.
+        '''
+        jobs = [RestartJob(mon, 'mon.' + str(mon.mon_id), mon.host)
+                for mon in mons]
+        scheduler = self._get_restart_scheduler(self._start_mons,
+                                                self._get_running_mons)
+        RestartScheduler.report(scheduler.run(jobs))
+        return all(job.came_up for job in jobs)
+
+    def _start_mons(self, mons):
+        if self.is_juju:
+            try:
+                results = self._execute_juju_batch(
+                    mons, self._mon_service_cmd('start'))
+            except TimeoutError:
+                results = {}
+            return dict((mon, results.get(mon, (None, None, None))[2] == 0)
+                        for mon in mons)
+        cmd = self._mon_service_cmd('start')
+        results = self.gather([(mon.connection, cmd) for mon in mons])
+        return dict((mon, result.ok) for mon, result in zip(mons, results))
+
+    def _get_running_mons(self, mons):
+        cmd = 'pidof ceph-mon'
+        if self.is_juju:
+            try:
+                results = self._execute_juju_batch(mons, cmd)
+            except TimeoutError:
+                return set()
+            return set(mon for mon in mons if results[mon][2] == 0)
+        results = self.gather([(mon.connection, cmd) for mon in mons],
+                              self.COMMAND_TIMEOUT)
+        return set(mon for mon, result in zip(mons, results) if result.ok)
 
     def _troubleshoot_mon_cli(self):
         '''
@@ -119,18 +169,17 @@ class TroubleshootCephMon(TroubleshootCeph):
             established
         '''
         print '\nProbable cause Ceph mon service not running in some machines'
-        print 'Try & start service in the machines not in quorum',
-        print '(yes/no) (default no)?',
-        response = raw_input()
+        # Start ceph cli check_list
+        approved, status = self._remediate(
+            'restart_mons',
+            'Try & start service in the machines not in quorum',
+            self._restart_dead_mon_daemons)
 
-        if response != 'yes':
+        if not approved:
             print 'not proceeding with updating machines, aborting'
             return
 
-        # Start ceph cli check_list
-        self._restart_dead_mon_daemons()
-
-        if self.poll_ceph_status(self.connection) == 'HEALTH_OK':
+        if status == 'HEALTH_OK':
             print 'Ceph Cluster working again :-)'
             exit()
         else:
@@ -149,137 +198,302 @@ class TroubleshootCephMon(TroubleshootCeph):
         except TimeoutError:
             print 'ceph health command did not work proceeding to next phase'
 
+        if status is None:
+            print 'Ceph reports no Clock Skew, measuring the mon clocks'
+            status = self._measure_clock_skew()
+
         if status is None:
             print 'Could not detect any Clock Skew, proceeding to deeper probe'
+            health = self.poll_ceph_status(self.connection)
         else:
-            print 'Clock Skew detected for', status, 'Try start ntp server?'
+            print 'Clock Skew detected for', status
             print 'We assume ntpd is installed here'
-            print '(yes/no) (default no)?',
-            response = raw_input()
-
-            if response != 'yes':
-                print 'aborting'
-                exit()
-            else:
-                self._correct_skew(status)
-
-        if self.poll_ceph_status(self.connection) == 'HEALTH_OK':
+            approved, health = self._remediate(
+                'restart_ntp', 'Try start ntp server?',
+                lambda: self._correct_skew(status))
+
+            if not approved:
+                if self.outcome.steps[-1]['decision'] == 'ask':
+                    print 'aborting'
+                    exit()
+                # not allowed by the policy, the rest may still be
+                print 'not restarting ntp, probing deeper'
+                health = None
+
+        if health == 'HEALTH_OK':
             print 'Ceph Cluster working again :-)'
             exit()
-        else:
+        elif status is not None and health is not None:
             print "Restarting ntpd didn't work, probing deeper"
 
         if self.advance:  # if the user desires advance checks.
-            print 'Inject correct monmap to machines with incorrect monmap?'
-            print '(yes/no) (default no)?',
-            response = raw_input()
+            approved, health = self._remediate(
+                'inject_monmap',
+                'Inject correct monmap to machines with incorrect monmap?',
+                self._repair_monmaps)
 
-            if response != 'yes':
+            if not approved:
                 print 'not proceeding with updating machines, aborting'
                 return
 
-            monmap_loc = self._find_correct_monmap(self.machines)
-            if monmap_loc is None:
-                print 'No Mon has correct monmap, recovery impossible, abort'
-                return
-
-            self._inject_mon_map(monmap_loc, self.machines)
-
-            if self.poll_ceph_status(self.connection) == 'HEALTH_OK':
+            result = self.outcome.steps[-1]['result']
+            if health == 'HEALTH_OK':
                 print 'Ceph Cluster working again :-)'
                 exit()
-            else:
+            elif result == 'error':
+                # no repair was tried, ex no mon has a correct monmap
+                return
+            elif result == 'unresolved':
                 print "Injecting Monmap didn't work, probably Network issue"
+            self._check_mon_network()
+
+    def _check_mon_network(self):
+        '''
+            Probe every mon from every live mon and report the mons the
+            network cuts off from the rest.
+
+            Returns:
+                list: sets of mon_ids able to reach each other, the
+                    largest first.
+        '''
+        print 'Probing the network between mons'
+        matrix = ReachabilityMatrix(self).measure(self.machines)
+        matrix.report()
+        return matrix.partitions()
+
+    def _repair_monmaps(self):
+        monmap_loc = self._find_correct_monmap(self.machines)
+        if monmap_loc is None:
+            print 'No Mon has correct monmap, recovery impossible, abort'
+            raise QuorumIssueNotResolvedError('no mon has a correct monmap')
+        progress = self._inject_mon_map(monmap_loc, self.machines)
+        return all(stage == 'done' for stage, error in progress.values())
 
     def _correct_skew(self, skew_list):
-        for mon in skew_list:
-            for machine in self.machines:
-                if mon == machine.mon_id:
-                    if self.init_type == 'systemd':
-                        cmd = 'sudo systemctl restart ntp.service'
-                    else:
-                        cmd = 'sudo service ntp restart'
-                    out, err = self._execute_command(machine.connection, cmd,
-                                                     self.is_juju)
-                    try:
-                        self._get_eof(out, cmd)
-                    except TimeoutError:
-                        print "Couldn't restart ntp for: ", mon
-                    else:
-                        print 'Restart successful for: ', mon
+        if self.init_type == 'systemd':
+            cmd = 'sudo systemctl restart ntp.service'
+        else:
+            cmd = 'sudo service ntp restart'
 
-    def _detect_clock_skew(self, connection):
-        out, err = self._execute_command(connection, 'sudo ceph health',
-                                         self.is_juju)
+        skewed = [self.registry.mon_by_id(mon) for mon in skew_list
+                  if self.registry.mon_by_id(mon) is not None]
+        if self.is_juju:
+            try:
+                results = self._execute_juju_batch(skewed, cmd)
+            except TimeoutError:
+                results = {}
+            restarted = dict((machine, results.get(
+                machine, (None, None, None))[2] == 0) for machine in skewed)
+        else:
+            results = self.gather([(machine.connection, cmd)
+                                   for machine in skewed],
+                                  self.COMMAND_TIMEOUT)
+            restarted = dict((machine, result.ok)
+                             for machine, result in zip(skewed, results))
+        for machine in skewed:
+            if restarted[machine]:
+                print 'Restart successful for: ', machine.mon_id
+            else:
+                print "Couldn't restart ntp for: ", machine.mon_id
+        return all(restarted.values())
 
-        try:
-            self._get_eof(out, 'sudo ceph health')
-        except TimeoutError:
-            raise TimeoutError('sudo ceph health timed out')
+    def _measure_clock_skew(self):
+        '''
+            Measure the clock of every live mon host at once, catching skew
+            ceph has not warned about yet.
 
-        status = MyStr(out).read().split(' ', 1)
-        if not (len(status) == 2 and status[0].strip() in self.BAD_HEALTH):
-            return None
+            Returns:
+                list: ids of the mons skewed beyond --clock-drift, the most
+                    skewed first, None when there are none.
+        '''
+        live = [machine for machine in self.machines
+                if machine.ssh_status == 'LIVE']
+        samples = ClockProbe(self).measure(live)
+        allowed = float(self.options.clock_drift)
+        ClockProbe.report(samples, allowed)
+        skewed = [sample.mon.mon_id for sample in samples
+                  if sample.skewed(allowed)]
+        return skewed or None
 
-        if re.search(r'clock skew detected on.*', status[1]) is None:
+    def _detect_clock_skew(self, connection):
+        report = self.get_health_report(connection)
+        if not report.has('MON_CLOCK_SKEW'):
             return None
-
-        skew_list = [i.strip()[4:] for i in
-                     re.findall(r'(mon\..*)[;]', status[1])[0].split(',')]
-        return skew_list
+        return report.get('MON_CLOCK_SKEW').mons() or None
 
     def _inject_mon_map(self, monmap_loc, machine_list):
-        for machine in machine_list:
-            if (machine.ssh_status == 'LIVE' and
-               machine.is_monmap_correct is False):
-                print 'Injecting monmap to: ' + machine.host
-                self._restart_ceph_mon_service('stop', machine.connection)
-
-                if self.is_juju:
-                    cmd = 'juju scp ' + monmap_loc + ' ' + str(machine.id) +\
-                        ':/tmp/monmap'
-                    subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
-                else:
-                    machine.connection.open_sftp().put(monmap_loc,
-                                                       '/tmp/monmap')
+        '''
+            Push the monmap at monmap_loc to every live mon with an
+            incorrect one, each host stopping, receiving, checking,
+            injecting and starting on its own so a slow host holds up no
+            other.
+
+            Returns:
+                dict: mon_id -> (stage, error) of every mon pushed to, the
+                    stage is 'done' when the mon runs with the new monmap.
+        '''
+        # Mons of the reference monmap, resolved through the registry
+        targets = [self.registry.mon_by_id(name)
+                   for name in self.reference_monmap.names
+                   if self.registry.mon_by_id(name) is not None]
+        targets = [machine for machine in targets
+                   if machine.ssh_status == 'LIVE' and
+                   machine.is_monmap_correct is False]
+        with open(monmap_loc, 'rb') as f:
+            digest = hashlib.md5(f.read()).hexdigest()
+        # workers do not see the deadline scope of this thread
+        deadline = current_deadline()
+
+        def push(machine):
+            seconds = None if deadline is None else deadline.remaining()
+            with deadline_scope(seconds, 'inject monmap'):
+                return self._push_monmap(machine, monmap_loc, digest)
+
+        progress = {}
+        for machine, result in zip(targets, run_in_parallel(
+                push, targets, self.options.workers)):
+            progress[machine.mon_id] = result
+            stage, error = result
+            if stage == 'done':
+                print 'Monmap injected to:', machine.host
+            else:
+                print 'Injecting monmap to', machine.host, 'failed at',
+                print stage + ':', error
+        done = [result for result in progress.values() if result[0] == 'done']
+        print 'Monmap injected to', len(done), 'of', len(targets), 'mons'
+        return progress
 
-                cmd = 'sudo ceph-mon -i ' + machine.mon_id +\
-                    ' --inject-monmap /tmp/monmap'
-                self._execute_command(machine.connection, cmd, self.is_juju)
+    def _push_monmap(self, machine, loc, digest):
+        '''
+            Stop the mon of machine, upload loc, check its md5 digest,
+            inject it and start the mon again.
 
-                self._restart_ceph_mon_service('start', machine.connection)
+            Returns:
+                tuple: (stage, error), stage is 'done' on success else the
+                    one that failed(stop, upload, verify, inject, start).
+        '''
+        print 'Injecting monmap to: ' + machine.host
+        stage = 'stop'
+        error = None
+        try:
+            if not self._restart_ceph_mon_service('stop', machine.connection):
+                error = 'could not stop ceph-mon'
+            else:
+                stage = 'upload'
+                self._copy_file(machine, loc, '/tmp/monmap')
+                stage = 'verify'
+                cmd = 'md5sum /tmp/monmap'
+                out, err, status = self._execute_with_status(
+                    machine.connection, cmd, self.is_juju)
+                if out.split()[:1] != [digest]:
+                    error = 'uploaded monmap does not match ' + digest
+                else:
+                    stage = 'inject'
+                    cmd = 'sudo ceph-mon -i ' + machine.mon_id +\
+                        ' --inject-monmap /tmp/monmap'
+                    out, err, status = self._execute_with_status(
+                        machine.connection, cmd, self.is_juju)
+                    if status != 0:
+                        error = err.strip() or 'exit status ' + str(status)
+        except Exception as err:
+            # one host failing must not stop the others
+            error = str(err) or err.__class__.__name__
+        # the mon is started again however far it got
+        if not self._restart_ceph_mon_service('start', machine.connection) \
+                and error is None:
+            stage, error = 'start', 'could not start ceph-mon'
+        return ('done', None) if error is None else (stage, error)
+
+    def _copy_file(self, machine, src, dst, upload=True):
+        '''
+            Copy the local src to dst on machine, or the remote src to the
+            local dst when upload is False, returning once it is done.
+        '''
+        if self.is_juju:
+            remote = str(machine.id) + ':'
+            if upload:
+                cmd = 'juju scp ' + src + ' ' + remote + dst
+            else:
+                cmd = 'juju scp ' + remote + src + ' ' + dst
+            with self.tracer.span('copy', cmd,
+                                  self._trace_target(machine.connection),
+                                  'juju'):
+                out, err = self._run_local(
+                    cmd, effective_deadline(self.COMMAND_TIMEOUT, cmd), cmd)
+                if err.startswith('ERROR'):
+                    raise IOError(err.strip())
+            return
+        with self.tracer.span('copy', ('put ' if upload else 'get ') + src,
+                              self._trace_target(machine.connection), 'ssh'):
+            sftp = machine.connection.open_sftp()
+            try:
+                if upload:
+                    sftp.put(src, dst)
+                else:
+                    sftp.get(src, dst)
+            finally:
+                sftp.close()
 
     def _find_correct_monmap(self, machine_list):
-        mon_host_id = []
+        '''
+            Pick the reference monmap, the newest one listing every mon,
+            by digest, mark the mons holding it as correct and fetch it.
+
+            Returns:
+                str: local path of the reference monmap, None when no mon
+                    holds a complete monmap or it could not be fetched.
+        '''
+        mon_host_id = sorted(machine.mon_id for machine in machine_list)
+        monmap_holders = self._get_monmap_holders(machine_list)
+        holders = {}
+        for mon_id, mon_status in monmap_holders.iteritems():
+            if mon_status.names == mon_host_id:
+                holders.setdefault(mon_status.digest, []).append(mon_id)
+        if not holders:
+            return None
+        # newest epoch first, the map most mons agree on among equals
+        reference = max(holders, key=lambda d: (d[0], len(holders[d])))
         for machine in machine_list:
-            mon_host_id.append(machine.mon_id)
-        mon_host_id.sort()
-        correct_mon_host = None
+            mon_status = monmap_holders.get(machine.mon_id)
+            machine.is_monmap_correct = (mon_status is not None and
+                                         mon_status.digest == reference)
+
+        loc = '/tmp/monmap'
         for machine in machine_list:
-            if (machine.ssh_status == 'LIVE' and
-               machine.admin_socket is not None):
-
-                cmd = 'sudo ceph --admin-daemon /var/run/ceph/' +\
-                    machine.admin_socket + ' mon_status'
-                out, err = self._execute_command(machine.connection, cmd,
-                                                 self.is_juju)
-                monmap = eval(MyStr(out).read())['monmap']['mons']
-                monmap_host_id = sorted([i['name'] for i in monmap])
-                if monmap_host_id == mon_host_id:
-                    loc = '/tmp/monmap'
-                    if correct_mon_host is None:
-                        try:
-                            self._save_monmap(machine, loc)
-                        except TimeoutError:
-                            pass
-                        else:
-                            correct_mon_host = machine
-                    machine.is_monmap_correct = True
-
-        if correct_mon_host is None:
-            return None
-        return loc
+            if not machine.is_monmap_correct:
+                continue
+            try:
+                self._save_monmap(machine, loc)
+            except (TimeoutError, IOError) as err:
+                print 'Could not save monmap of', machine.mon_id + ':', err
+            else:
+                self.reference_monmap = monmap_holders[machine.mon_id]
+                return loc
+        return None
+
+    def _get_monmap_holders(self, machine_list):
+        '''
+            Ask every live mon for its monmap over the admin socket, all at
+            once, each with its own deadline.
+
+            Returns:
+                dict: mon_id -> MonStatus, mons that did not answer in time
+                    are left out.
+        '''
+        live = [machine for machine in machine_list
+                if machine.ssh_status == 'LIVE' and
+                machine.admin_socket is not None]
+        jobs = [(machine.connection, 'sudo ceph --admin-daemon /var/run/ceph/'
+                 + machine.admin_socket + ' mon_status --format json')
+                for machine in live]
+        monmaps = {}
+        for machine, result in zip(live, self.gather(jobs,
+                                                     self.COMMAND_TIMEOUT)):
+            try:
+                monmaps[machine.mon_id] = MonStatus.from_json(result.stdout)
+            except (ValueError, KeyError):
+                print 'No monmap from', machine.mon_id
+        return monmaps
 
     def _save_monmap(self, mon_host, loc):
         '''
@@ -291,30 +505,26 @@ class TroubleshootCephMon(TroubleshootCeph):
         self._restart_ceph_mon_service('stop', mon_host.connection)
         cmd = 'sudo ceph-mon -i ' + mon_host.mon_id + ' --extract-monmap ' +\
             '/tmp/monmap'
-        out, err = self._execute_command(mon_host.connection, cmd,
-                                         self.is_juju)
-
         try:
-            self._get_eof(out, cmd)
-        except TimeoutError:
-            raise TimeoutError('ceph mon getmap timed out')
-            cmd = 'juju scp ' + str(mon_host.id) + ':/tmp/monmap ' + loc
-            if self.is_juju:
-                subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE)
-            else:
-                mon_host.connection.open_sftp().get('/tmp/monmap', loc)
-
-        self._restart_ceph_mon_service('start', mon_host.connection)
+            out, err = self._execute_command(mon_host.connection, cmd,
+                                             self.is_juju)
+            try:
+                self._get_eof(out, cmd)
+            except TimeoutError:
+                raise TimeoutError('ceph mon getmap timed out')
+            self._copy_file(mon_host, '/tmp/monmap', loc, upload=False)
+        finally:
+            self._restart_ceph_mon_service('start', mon_host.connection)
 
     def _get_juju_machine_objects(self):
         # Here we assume all ceph/* have a mon service
         machines = []
+        self._prefetch_host_facts([m for m in self.juju_ceph_machines
+                                   if m.has_mon is True])
         for machine in self.juju_ceph_machines:
             if machine.has_mon is True:
-                out, err = self._execute_command(machine, 'ls /var/run/ceph',
-                                                 is_juju=True)
-                socket = self._find_mon_socket(MyStr(out).read().split('\n'))
+                facts = self._get_host_facts(machine, juju=True)
+                socket = self._find_mon_socket(facts['sockets'])
                 machine = MonObject.juju_machine(machine.public_addr, socket,
                                                  machine.hostname,
                                                  machine.name, machine.id)
@@ -328,19 +538,17 @@ class TroubleshootCephMon(TroubleshootCeph):
         for i in mon_list:
             addr = i
             if self.cli_down:
-                for m in self.juju_ceph_machines:
-                    if m.internal_ip == i:
-                        addr = m.public_addr
+                m = self.registry.machine_by_internal_ip(i)
+                if m is not None:
+                    addr = m.public_addr
             try:
                 connection = self._get_connection(addr)
             except ConnectionFailedError as err:
                 dead_mon = MonObject(addr, 'DEAD')
                 machines.append(dead_mon)
             else:
-                out, err = self._execute_command(connection,
-                                                 'ls /var/run/ceph/',
-                                                 self.is_juju)
-                socket = self._find_mon_socket(out.read().split('\n'))
+                facts = self._get_host_facts(connection, self.is_juju)
+                socket = self._find_mon_socket(facts['sockets'])
                 live_mon = MonObject(addr, 'LIVE', connection, socket)
                 machines.append(live_mon)
         return machines
@@ -364,31 +572,54 @@ class TroubleshootCephMon(TroubleshootCeph):
 
     def _restart_dead_mon_daemons(self):
         (output, err) = self._execute_command(self.connection,
-                                              'sudo ceph mon_status',
+                                              MonStatus.COMMAND,
                                               self.is_juju)
-
-        mon_status = eval(MyStr(output).read())
-        quorum_list = mon_status['quorum']
-        mon_list = mon_status['monmap']['mons']
-
-        if len(quorum_list) != len(mon_list):
-            for mon in mon_list:
-                if mon['rank'] not in quorum_list:
-                    print '\n' + mon['name'] + ' not in quorum list,',
-                    print 'restarting ceph services'
-                    if not self.is_juju:
-                        mon_addr = mon['addr'].split(':')[0]
-                        connection = self._get_connection(mon_addr)
-                    else:
-                        for machine in self.machines:
-                            if machine.mon_id == mon['name']:
-                                connection = machine
-                                break
-                    self._restart_ceph_mon_service('start', connection)
+        mon_status = MonStatus.from_json(MyStr(output).read())
+
+        dead_mons = []
+        for mon in mon_status.out_of_quorum():
+            print '\n' + mon.name + ' not in quorum list,',
+            print 'restarting ceph services'
+            if not self.is_juju:
+                try:
+                    connection = self._get_connection(mon.ip)
+                except ConnectionFailedError:
+                    print 'Could not connect to', mon.ip
+                    continue
+                dead_mon = MonObject(mon.ip, 'LIVE', connection)
+                dead_mon.mon_id = mon.name
+                dead_mons.append(dead_mon)
+            elif self.registry.mon_by_id(mon.name) is not None:
+                dead_mons.append(self.registry.mon_by_id(mon.name))
+        succeeded = self._restart_mons(dead_mons)
+
+        if dead_mons:
+            watcher = StatusWatcher(self, self.connection)
+            target = mons_in_quorum([mon.mon_id for mon in dead_mons])
+            watcher.wait(target, int(self.options.timeout))
+            succeeded = succeeded and watcher.reached
+        return succeeded
+
+    def _mon_service_cmd(self, cmd):
+        if self.init_type in ['upstart', 'sysv-init']:
+            return 'sudo ' + cmd + ' ceph-mon-all'
+        return 'sudo systemctl ' + cmd + ' ceph-mon.service'
 
     def _restart_ceph_mon_service(self, cmd, connection):
-        if self.init_type in ['upstart', 'sysv-init']:
-            cmd = 'sudo ' + cmd + ' ceph-mon-all'
-        else:
-            cmd = 'sudo systemctl ' + cmd + ' ceph-mon.service'
-        self._execute_command(connection, cmd, self.is_juju)
+        '''
+            Start or stop the mon service on connection, returns whether
+            it worked. A mon no longer running counts as stopped whatever
+            stopping it returned, ex upstart fails to stop a crashed mon.
+        '''
+        service_cmd = self._mon_service_cmd(cmd)
+        try:
+            out, err, status = self._execute_with_status(
+                connection, service_cmd, self.is_juju)
+            if status != 0 and cmd == 'stop':
+                # pidof exits 1 when no process is found
+                out, err, status = self._execute_with_status(
+                    connection, 'pidof ceph-mon', self.is_juju)
+                return status == 1
+            return status == 0
+        except TimeoutError:
+            return False
@@ -2,6 +2,9 @@ import json
 
 from helpers.exceptions import ConnectionFailedError, TimeoutError
 from helpers.helpers import MyStr
+from helpers.json_stream import JsonStream
+from restart_scheduler import RestartJob, RestartScheduler
+from status_watcher import StatusWatcher, osds_up_in
 from troubleshoot_ceph import TroubleshootCeph
 
 
@@ -25,8 +28,13 @@ class OsdObject(object):
             **kwargs (dict): Additional parameters required when object is
                 initialized using juju_machine method. Juju cli requires an
                 additional id attribute and juju machine_name attribute.
+                Only the juju fields listed in __slots__ are accepted.
 
     """
+    __slots__ = ('name', 'osd_id', 'host', 'ssh_status', 'connection',
+                 'status', 'in_cluster', 'juju_id', 'juju_name', 'hostname',
+                 'public_addr')
+
     def __init__(self, host, name, osd_id, ssh_status, status, in_cluster,
                  connection=None, **kwargs):
         self.name = name
@@ -36,6 +44,8 @@ class OsdObject(object):
         self.connection = connection
         self.status = status
         self.in_cluster = in_cluster
+        self.juju_id = self.juju_name = None
+        self.hostname = self.public_addr = None
         if 'juju_id' in kwargs:
             self.connection = self
         for key, value in kwargs.iteritems():
@@ -55,8 +65,11 @@ class OsdObject(object):
 
 
 class TroubleshootCephOsd(TroubleshootCeph):
+    # fields of the osd tree nodes the troubleshooter uses
+    OSD_TREE_FIELDS = ('id', 'name', 'type', 'status', 'reweight', 'children')
+
     def troubleshoot_osd(self):
-        status = self._poll_osd_status(self.connection)
+        status = self._get_osd_health_status()
         print status
         if status == 'OSD_FULL':
             print 'OSD objects almost full'
@@ -70,36 +83,122 @@ class TroubleshootCephOsd(TroubleshootCeph):
         self.osd_objects = self._get_all_osd_object()
 
         # Let's try restarting osd daemons that are down
-        print 'trying to restart osd daemon that are down'
-        self._restart_dead_osd()
+        approved, status = self._remediate(
+            'restart_osds', 'Restart the osd daemons that are down?',
+            self._restart_dead_osd, osds_up_in(), default=True)
+        if status == 'OSD_OK':
+            print 'All OSDs up and in again :-)'
 
     def _restart_dead_osd(self):
-        for osd in self.osd_objects:
-            if osd.ssh_status and osd.status == 'down':
-                self._restart_osd(osd)
+        dead = [osd for osd in self.osd_objects
+                if osd.ssh_status and osd.status == 'down']
+        domains = self._get_failure_domains(self.osd_tree,
+                                            self.options.failure_domain)
+        jobs = [RestartJob(osd, osd.name, osd.host, domains.get(osd.osd_id))
+                for osd in dead]
+        scheduler = self._get_restart_scheduler(self._restart_osds,
+                                                self._get_up_osds)
+        RestartScheduler.report(scheduler.run(jobs))
+        return all(job.came_up for job in jobs)
+
+    def _restart_osds(self, osds):
+        if self.is_juju:
+            return self._restart_osds_batch(osds)
+        jobs = [(osd.connection, self._osd_service_cmd(osd.osd_id))
+                for osd in osds]
+        succeeded = {}
+        for osd, result in zip(osds, self.gather(jobs)):
+            succeeded[osd] = result.ok
+            print osd.name + ': ' + result.command + (' successful'
+                                                      if result.ok
+                                                      else ' failed')
+        return succeeded
 
-    def _restart_osd(self, osd, cmd='start'):
+    def _get_up_osds(self, osds):
+        cmd = 'sudo ceph osd dump --format json'
+        try:
+            out, err = self._execute_command(self.connection, cmd,
+                                             self.is_juju)
+            self._get_eof(out, cmd)
+            dump = json.loads(MyStr(out).read())
+        except (TimeoutError, ValueError):
+            return set()
+        up = set(o['osd'] for o in dump.get('osds', []) if o.get('up'))
+        return set(osd for osd in osds if osd.osd_id in up)
+
+    def _get_failure_domains(self, osd_tree, domain_type):
+        ''' Map osd id to the name of its crush ancestor of domain_type '''
+        nodes = dict((node['id'], node) for node in osd_tree['nodes'])
+        parents = {}
+        for node in osd_tree['nodes']:
+            for child in node.get('children', []):
+                parents[child] = node['id']
+
+        domains = {}
+        for node in osd_tree['nodes']:
+            if node.get('type') != 'osd':
+                continue
+            parent = parents.get(node['id'])
+            while parent is not None and \
+                    nodes[parent].get('type') != domain_type:
+                parent = parents.get(parent)
+            if parent is not None:
+                domains[node['id']] = nodes[parent]['name']
+        return domains
+
+    def _osd_service_cmd(self, osd_id, cmd='start'):
         if self.init_type in ['upstart', 'sysv-init']:
-            cmd = 'sudo ' + cmd + ' ceph-osd id=' + str(osd.osd_id)
-        else:
-            cmd = 'sudo systemctl ' + cmd + ' ceph-osd@' + str(osd.osd_id) +\
-                '.service'
-        out, err = self._execute_command(osd.connection, cmd, self.is_juju)
-        print osd.name + ': ' + cmd + ' successful'
+            return 'sudo ' + cmd + ' ceph-osd id=' + str(osd_id)
+        return 'sudo systemctl ' + cmd + ' ceph-osd@' + str(osd_id) +\
+            '.service'
+
+    def _restart_osds_batch(self, osds, cmd='start'):
+        '''
+            Restart osds on all their machines with one juju run. Every
+            machine picks its own osd ids by hostname and reports
+            '<osd_id> <exit_code>' for each restart.
+        '''
+        if not osds:
+            return {}
+        ids_by_host = {}
+        for osd in osds:
+            ids_by_host.setdefault(osd.host, []).append(str(osd.osd_id))
+
+        script = 'case `cat /etc/hostname` in\n'
+        for host, ids in ids_by_host.iteritems():
+            script += host + ') ids="' + ' '.join(ids) + '";;\n'
+        script += '*) ids="";;\nesac\n'
+        script += 'for id in $ids; do ' + self._osd_service_cmd('$id', cmd)
+        script += ' > /dev/null 2>&1; echo "$id $?"; done\n'
+
+        try:
+            results = self._execute_juju_batch(osds, script)
+        except TimeoutError:
+            results = {}
+        succeeded = {}
+        for osd in osds:
+            out = results.get(osd, ('', '', None))[0]
+            codes = dict(line.split(' ', 1) for line in out.splitlines()
+                         if ' ' in line)
+            succeeded[osd] = codes.get(str(osd.osd_id), '').strip() == '0'
+            print osd.name + ': ' + cmd + (' successful' if succeeded[osd]
+                                           else ' failed')
+        return succeeded
 
     def _get_all_osd_object(self):
         osd_objects = []
-        osd_list = self._get_osd_list()
-        out, err = self._execute_command(self.connection,
-                                         'sudo ceph osd tree --format=json',
-                                         self.is_juju)
-        osd_tree = json.loads(MyStr(out).read())
+        osd_list = set(self._get_osd_list())
+        osd_tree = self._get_osd_tree()
+        self.osd_tree = osd_tree
+        osd_hosts = self._get_osd_hosts(osd_tree)
 
         for node in osd_tree['nodes']:
             if node['name'] in osd_list:
                 status = node['status']
                 in_cluster = 'out' if node['reweight'] == 0.0 else 'in'
-                host = self._get_osd_details(node['id'])
+                host = osd_hosts.get(node['id'])
+                if host is None:
+                    host = self._get_osd_details(node['id'])
 
                 if self.is_juju:
                     osd_obj = self._get_juju_osd_object(node, host, status,
@@ -107,9 +206,9 @@ class TroubleshootCephOsd(TroubleshootCeph):
                 else:
                     try:
                         if self.cli_down:
-                            for m in self.juju_ceph_machines:
-                                if m.hostname == host:
-                                    host = m.public_addr
+                            m = self.registry.machine_by_hostname(host)
+                            if m is not None:
+                                host = m.public_addr
                         conn = self._get_connection(host)
                     except ConnectionFailedError as err:
                         osd_obj = OsdObject(host, node['name'], node['id'],
@@ -119,15 +218,39 @@ class TroubleshootCephOsd(TroubleshootCeph):
                         osd_obj = OsdObject(host, node['name'], node['id'],
                                             True, status, in_cluster, conn)
                 osd_objects.append(osd_obj)
+                if osd_obj is not None:
+                    self.registry.add_osd(osd_obj)
         return osd_objects
 
+    def _get_osd_tree(self):
+        '''
+            `ceph osd tree` keeping only OSD_TREE_FIELDS of every node, the
+            output is parsed as it streams in.
+        '''
+        cmd = 'sudo ceph osd tree --format=json'
+        nodes = []
+        with self._stream_command(self.connection, cmd, self.is_juju) as out:
+            for trail, node in JsonStream(out).items([('nodes',)]):
+                nodes.append(dict((field, node[field]) for field
+                                  in self.OSD_TREE_FIELDS if field in node))
+        return {'nodes': nodes}
+
     def _get_juju_osd_object(self, node, host, status, in_cluster):
-        for machine in self.juju_ceph_machines:
-            if machine.hostname == host:
-                return OsdObject.juju_machine(host, node['name'], node['id'],
-                                              status, in_cluster,
-                                              machine.public_addr, machine.id,
-                                              machine.name)
+        machine = self.registry.machine_by_hostname(host)
+        if machine is not None:
+            return OsdObject.juju_machine(host, node['name'], node['id'],
+                                          status, in_cluster,
+                                          machine.public_addr, machine.id,
+                                          machine.name)
+
+    def _get_osd_hosts(self, osd_tree):
+        ''' Map osd id to host name using the host buckets of the osd tree '''
+        osd_hosts = {}
+        for node in osd_tree['nodes']:
+            if node.get('type') == 'host':
+                for child in node.get('children', []):
+                    osd_hosts[child] = node['name']
+        return osd_hosts
 
     def _get_osd_details(self, osd_id):
         cmd = 'sudo ceph osd find ' + str(osd_id) + ' --format json'
@@ -142,23 +265,18 @@ class TroubleshootCephOsd(TroubleshootCeph):
         return map(lambda x: 'osd.' + str(x), filter(lambda x: x is not '',
                                                      out.read().split('\n')))
 
+    def _get_osd_health_status(self):
+        ''' Dispatch on the osd check codes of this pass's health report '''
+        try:
+            report = self.get_health_report(self.connection)
+        except TimeoutError:
+            return self._poll_osd_status(self.connection)
+        if report.has('OSD_FULL', 'OSD_NEARFULL', 'OSD_BACKFILLFULL'):
+            return 'OSD_FULL'
+        elif report.has('OSD_DOWN', 'OSD_HOST_DOWN', 'OSD_ROOT_DOWN'):
+            return 'OSD_NOT_OK'
+        return 'OSD_OK'
+
     def _poll_osd_status(self, connection):
-        tries = int(self.options.timeout) / 10
-        status = None
-        cmd = 'sudo ceph osd stat --format json'
-        for i in range(tries):
-            (out, err) = self._execute_command(connection, cmd, self.is_juju)
-            try:
-                self._get_eof(out, cmd)
-            except TimeoutError:
-                print 'retrying status'
-            else:
-                status = json.loads(MyStr(out).read())
-                if status['full'] or status['nearfull']:
-                    return 'OSD_FULL'
-                elif (status['num_osds'] == status['num_up_osds'] and
-                      status['num_up_osds'] == status['num_in_osds']):
-                    return 'OSD_OK'
-                else:
-                    return 'OSD_NOT_OK'
-        return status
+        watcher = StatusWatcher(self, connection)
+        return watcher.query(osds_up_in(), int(self.options.timeout))
@@ -0,0 +1,211 @@
+import paramiko
+import socket
+import time
+
+from helpers.exceptions import ConnectionFailedError, TimeoutError
+from helpers.helpers import MyStr, run_in_parallel
+from mon_status import MonStatus
+from troubleshoot_ceph import TroubleshootCeph
+from troubleshoot_ceph_mon import MonObject, TroubleshootCephMon
+from troubleshoot_ceph_osd import TroubleshootCephOsd
+
+# a host that dropped or can not be reached, the cluster is seen as down
+HOST_ERRORS = (TimeoutError, ConnectionFailedError, paramiko.SSHException,
+               socket.error, EOFError)
+
+
+class ClusterSnapshot(object):
+    """ What one watch cycle saw of the cluster.
+
+        Taken from `ceph health detail` and `ceph mon_status` only, so a
+        cycle costs two cheap commands however large the cluster.
+
+        Args:
+            status (str): overall health, None when the ceph cli is down.
+            codes (list): codes of the failing health checks.
+            quorum (list): names of the mons in quorum.
+            out_of_quorum (list): names of the mons out of quorum.
+            down_osds (list): ids of the osds reported down.
+            skewed_mons (list): names of the mons with a skewed clock.
+    """
+
+    def __init__(self, status=None, codes=(), quorum=(), out_of_quorum=(),
+                 down_osds=(), skewed_mons=()):
+        self.status = status
+        self.codes = sorted(codes)
+        self.quorum = sorted(quorum)
+        self.out_of_quorum = sorted(out_of_quorum)
+        self.down_osds = sorted(down_osds)
+        self.skewed_mons = sorted(skewed_mons)
+
+    @classmethod
+    def take(cls, troubleshooter, connection):
+        try:
+            report = troubleshooter.get_health_report(connection,
+                                                      refresh=True)
+            out, err = troubleshooter._execute_command(
+                connection, MonStatus.COMMAND, troubleshooter.is_juju,
+                troubleshooter.COMMAND_TIMEOUT)
+            troubleshooter._get_eof(out, MonStatus.COMMAND)
+            mon_status = MonStatus.from_json(MyStr(out).read())
+        except HOST_ERRORS + (ValueError, KeyError):
+            return cls()
+        down_osds = []
+        for code in ('OSD_DOWN', 'OSD_HOST_DOWN'):
+            if report.has(code):
+                down_osds += report.get(code).osds()
+        skewed = []
+        if report.has('MON_CLOCK_SKEW'):
+            skewed = report.get('MON_CLOCK_SKEW').mons()
+        return cls(report.status, report.codes, mon_status.quorum_names,
+                   [mon.name for mon in mon_status.out_of_quorum()],
+                   set(down_osds), skewed)
+
+    def diff(self, previous):
+        '''
+            Changes since the previous snapshot.
+
+            Returns:
+                list: (event, subject) tuples, ex ('osd_down', 5).
+        '''
+        events = []
+        if self.status != previous.status:
+            events.append(('health', '%s -> %s' % (previous.status,
+                                                   self.status)))
+        if self.status is None:
+            return events
+        pairs = [('down_osds', 'osd_down', 'osd_up'),
+                 ('out_of_quorum', 'mon_left_quorum', 'mon_joined_quorum'),
+                 ('skewed_mons', 'clock_skew', 'clock_skew_cleared')]
+        for field, appeared, cleared in pairs:
+            now = set(getattr(self, field))
+            before = set(getattr(previous, field))
+            if previous.status is None:
+                before = now  # nothing to compare with after an outage
+            events += [(appeared, item) for item in sorted(now - before)]
+            events += [(cleared, item) for item in sorted(before - now)]
+        return events
+
+
+class Watchdog(object):
+    """ Long running mode re-checking the cluster every interval.
+
+        Connections, the juju topology and the mon/osd objects are kept
+        between cycles. A cycle takes a ClusterSnapshot, reports what
+        changed since the previous one and re-probes only the hosts of the
+        daemons that changed.
+
+        Args:
+            interval (int): seconds between two cycles.
+            args (list): command line, sys.argv when None.
+    """
+
+    def __init__(self, interval, args=None):
+        self.interval = interval
+        self.osd = TroubleshootCephOsd(args)
+        self.mon = TroubleshootCephMon(is_ceph_cli=True)
+        self.snapshot = None
+        self.discovered = False
+
+    def run(self, cycles=None):
+        ''' Watch until interrupted, or for the given number of cycles '''
+        cycle = 0
+        try:
+            while cycles is None or cycle < cycles:
+                start = time.time()
+                self.cycle()
+                cycle += 1
+                if cycles is None or cycle < cycles:
+                    time.sleep(max(0, self.interval -
+                                   (time.time() - start)))
+        except KeyboardInterrupt:
+            print '\nwatch stopped'
+
+    def cycle(self):
+        try:
+            snapshot = ClusterSnapshot.take(TroubleshootCeph, self._leader())
+        except ConnectionFailedError:
+            snapshot = ClusterSnapshot()
+        if not self.discovered and snapshot.status is not None:
+            self.discover()
+            print self._stamp(), 'watching', snapshot.status,
+            print 'quorum:', ','.join(snapshot.quorum),
+            print 'down osds:', len(snapshot.down_osds)
+        events = [] if self.snapshot is None else snapshot.diff(self.snapshot)
+        for event, subject in events:
+            print self._stamp(), event, subject
+        self.snapshot = snapshot
+        if self.discovered:
+            self.refresh(events)
+        return events
+
+    def discover(self):
+        ''' Full discovery of mons and osds, done once '''
+        mon = self.mon
+        if mon.is_juju:
+            mon.machines = mon._get_juju_machine_objects()
+        else:
+            mon.machines = mon._get_machine_objects()
+        for machine in mon.machines:
+            mon.registry.add_mon(machine)
+        self.osd.osd_objects = self.osd._get_all_osd_object()
+        self.discovered = True
+
+    def refresh(self, events):
+        ''' Update the objects and re-probe the hosts of changed daemons '''
+        registry = TroubleshootCeph.registry
+        changed = []
+        for event, subject in events:
+            if event in ('osd_down', 'osd_up'):
+                osd = registry.osd_by_id(subject)
+                if osd is None:
+                    # an osd this watch has not seen yet
+                    self.osd.osd_objects = self.osd._get_all_osd_object()
+                    osd = registry.osd_by_id(subject)
+                if osd is not None:
+                    osd.status = 'down' if event == 'osd_down' else 'up'
+                    changed.append(osd)
+            elif event in ('mon_left_quorum', 'mon_joined_quorum',
+                           'clock_skew', 'clock_skew_cleared'):
+                mon = registry.mon_by_id(subject)
+                if mon is not None:
+                    changed.append(mon)
+
+        targets = []
+        for daemon in changed:
+            if daemon.connection is not None and \
+                    daemon.connection not in targets:
+                targets.append(daemon.connection)
+        if not targets:
+            return
+        ts = TroubleshootCeph
+        for target in targets:
+            ts.host_facts.pop(ts._facts_key(target), None)
+        if ts.is_juju:
+            ts._prefetch_host_facts(targets)
+        run_in_parallel(self._probe, targets, ts.options.workers)
+        for daemon in changed:
+            facts = ts.host_facts.get(ts._facts_key(daemon.connection))
+            if facts is not None and isinstance(daemon, MonObject):
+                daemon.admin_socket = self.mon._find_mon_socket(
+                    facts['sockets'])
+
+    def _leader(self):
+        '''
+            Connection to the host the ceph commands run on, through the
+            pool over ssh so a dropped session is connected again.
+        '''
+        ts = TroubleshootCeph
+        if ts.is_juju:
+            return ts.connection
+        return ts._get_connection(ts.connection.hostname)
+
+    def _probe(self, target):
+        try:
+            TroubleshootCeph._get_host_facts(target, TroubleshootCeph.is_juju)
+        except HOST_ERRORS + (ValueError,):
+            print self._stamp(), 'could not probe', \
+                TroubleshootCeph._trace_target(target)
+
+    def _stamp(self):
+        return time.strftime('%Y-%m-%d %H:%M:%S')
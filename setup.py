@@ -16,7 +16,8 @@ setup(
         'diagnose_ceph': ['diagnose_ceph/scripts/*.sh'],
     },
     entry_points={
-        'console_scripts': ['diagnose_ceph=diagnose_ceph.run:run', ],
+        'console_scripts': ['diagnose_ceph=diagnose_ceph.run:run',
+                            'diagnose_ceph_fleet=diagnose_ceph.fleet:run', ],
     },
     license='MIT',
     description=desc,
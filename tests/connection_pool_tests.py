@@ -0,0 +1,84 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'diagnose_ceph'))
+
+from helpers.connection_pool import ConnectionPool  # noqa: E402
+from replay import ReplayTransport  # noqa: E402
+
+
+class FakeChannel(object):
+    def __init__(self):
+        self.closed = False
+        self.done = False
+
+    def exit_status_ready(self):
+        return self.done
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.active = True
+        self._channels = {}
+
+    def is_active(self):
+        return self.active
+
+    def send_ignore(self):
+        pass
+
+
+class FakeClient(object):
+    def __init__(self, hostname):
+        self.hostname = hostname
+        self.transport = FakeTransport()
+
+    def get_transport(self):
+        return self.transport
+
+    def exec_command(self, command):
+        return self.hostname, command
+
+    def close(self):
+        self.transport.active = False
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.connected = []
+        self.pool = ConnectionPool(self._connect, max_connections=2)
+
+    def _connect(self, hostname):
+        self.connected.append(hostname)
+        return FakeClient(hostname)
+
+    def test_evicted_host_reconnects_through_its_handle(self):
+        handles = [self.pool.get(host) for host in ('a', 'b', 'c')]
+        self.assertEqual(self.pool.stats()['open'], 2)
+        self.assertEqual(handles[0].exec_command('uptime'), ('a', 'uptime'))
+        self.assertEqual(self.connected, ['a', 'b', 'c', 'a'])
+        self.assertIs(self.pool.get('a'), handles[0])
+        self.assertEqual(self.pool.stats()['open'], 2)
+
+    def test_busy_client_is_not_evicted(self):
+        channels = [FakeChannel(), FakeChannel()]
+        for host, channel in zip(('a', 'b'), channels):
+            self.pool.get(host).get_transport()._channels[0] = channel
+        self.pool.get('c')
+        # over the cap until a command finishes
+        self.assertEqual(self.pool.stats()['open'], 3)
+        channels[1].done = True
+        self.pool.get('d')
+        self.assertEqual(sorted(self.pool._clients), ['a', 'd'])
+        self.assertEqual(self.connected, ['a', 'b', 'c', 'd'])
+
+    def test_handle_works_with_replayed_hosts(self):
+        transport = ReplayTransport([('uptime', 'up\n')])
+        pool = ConnectionPool(transport.connect, max_connections=1)
+        first = pool.get('10.0.0.1')
+        pool.get('10.0.0.2')
+        stdin, stdout, stderr = first.exec_command('uptime')
+        self.assertEqual(stdout.read(), 'up\n')
+        self.assertEqual(transport.connections, 3)
@@ -0,0 +1,52 @@
+import json
+import os
+import sys
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'diagnose_ceph'))
+
+from helpers.json_stream import JsonStream  # noqa: E402
+
+STATUS = {
+    'model': {'name': 'tricky "}]{[" name'},
+    'machines': dict((str(i), {'series': 'xenial', 'containers': {}})
+                     for i in range(40)),
+    'applications': {
+        'ntp': {'units': {'ntp/0': {'machine': '9'}}},
+        'ceph': {'units': dict(('ceph/%d' % i,
+                                {'machine': str(i),
+                                 'public-address': '10.0.0.%d' % i})
+                               for i in range(3))},
+        'ceph-osd': {'units': None},
+    },
+}
+
+
+class TestJsonStream(unittest.TestCase):
+    def _items(self, document, path, chunk_size):
+        stream = JsonStream(StringIO(json.dumps(document)), chunk_size)
+        return list(stream.items(path))
+
+    def test_items_across_chunk_boundaries(self):
+        path = [('applications', 'services'), ('ceph', 'ceph-osd'),
+                ('units',)]
+        for chunk_size in (1, 7, 65536):
+            items = self._items(STATUS, path, chunk_size)
+            self.assertEqual(dict(unit for trail, unit in items),
+                             STATUS['applications']['ceph']['units'])
+            self.assertEqual(set(trail for trail, unit in items),
+                             set([('applications', 'ceph', 'units')]))
+
+    def test_array_items(self):
+        tree = {'nodes': [{'id': -1, 'children': [0, 1]}, 12345, -2.5e3],
+                'stray': []}
+        for chunk_size in (1, 3, 65536):
+            self.assertEqual([node for trail, node
+                              in self._items(tree, [('nodes',)], chunk_size)],
+                             tree['nodes'])
+
+    def test_truncated_document(self):
+        stream = JsonStream(StringIO('{"nodes": [{"id": 1}, {"id"'), 4)
+        self.assertRaises(ValueError, list, stream.items([('nodes',)]))
@@ -0,0 +1,388 @@
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import unittest
+
+# the modules import each other by their bare names, as run from the package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'diagnose_ceph'))
+
+from benchmark import SyntheticCluster, run_diagnosis  # noqa: E402
+from clock_probe import ClockProbe  # noqa: E402
+from helpers.deadline import Deadline  # noqa: E402
+from helpers.exceptions import TimeoutError  # noqa: E402
+from replay import ReplayTransport  # noqa: E402
+from troubleshoot_ceph import JujuCephMachine, TroubleshootCeph  # noqa: E402
+from troubleshoot_ceph_mon import TroubleshootCephMon  # noqa: E402
+from troubleshoot_ceph_osd import TroubleshootCephOsd  # noqa: E402
+from watchdog import Watchdog  # noqa: E402
+
+
+class TestReplayDiagnosis(unittest.TestCase):
+    """Round trips of the diagnosis phases against synthetic clusters."""
+
+    def _phases(self, cluster, **kwargs):
+        return dict((phase['phase'], phase)
+                    for phase in run_diagnosis(cluster, **kwargs))
+
+    def test_osd_objects_come_from_the_osd_tree(self):
+        cluster = SyntheticCluster(3, 100, osds_per_host=10)
+        phases = self._phases(cluster)
+        self.assertEqual(phases['osd objects']['calls'], 2)
+        self.assertEqual(phases['osd objects']['connections'], 10)
+
+    def test_one_probe_per_mon(self):
+        phases = self._phases(SyntheticCluster(5, 10))
+        self.assertEqual(phases['discovery']['calls'], 1)
+        # the leader was probed during discovery already
+        self.assertEqual(phases['mon objects']['calls'], 4)
+        self.assertEqual(phases['monmaps']['calls'], 5)
+
+    def test_monmaps_are_fetched_concurrently(self):
+        cluster = SyntheticCluster(7, 10)
+        phases = self._phases(cluster, latency=[('mon_status', 0.2)])
+        self.assertLess(phases['monmaps']['time'], 0.2 * 7 / 2)
+
+    def test_trace_has_a_span_per_remote_call(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        cluster = SyntheticCluster(3, 10)
+        try:
+            phases = run_diagnosis(cluster, extra_args=['--trace', path])
+            with open(path, 'r') as f:
+                spans = [json.loads(line) for line in f]
+        finally:
+            os.remove(path)
+        kinds = [span['kind'] for span in spans]
+        self.assertEqual(kinds.count('connect'),
+                         sum(phase['connections'] for phase in phases))
+        self.assertEqual(kinds.count('exec') + kinds.count('gather'),
+                         sum(phase['calls'] for phase in phases))
+
+    @contextmanager
+    def _session(self, transport):
+        ''' Answer TroubleshootCeph from transport, silencing stdout '''
+        TroubleshootCeph.reset_session()
+        TroubleshootCeph.transport = transport
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            yield transport
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+            TroubleshootCeph.reset_session()
+            TroubleshootCeph.transport = None
+
+    def _mon(self, cluster, *args):
+        ''' TroubleshootCephMon of cluster, its mons discovered over ssh '''
+        TroubleshootCeph(['-H', cluster.leader, '-u', 'u', '-p', 'p'] +
+                         list(args))
+        mon = TroubleshootCephMon(True)
+        mon.machines = mon._get_machine_objects()
+        for machine in mon.machines:
+            mon.registry.add_mon(machine)
+        return mon
+
+    def test_juju_discovery_is_batched(self):
+        cluster = SyntheticCluster(3, 24)
+        with self._session(cluster.transport()) as transport:
+            TroubleshootCeph(['-P', 'juju', '--cache-ttl', '0'])
+            machines = TroubleshootCeph.juju_ceph_machines
+        # juju --version, juju status and a single probe of every unit
+        self.assertEqual(transport.calls, 3)
+        self.assertEqual(len(machines), 5)
+
+    def test_juju_batch_error_leaves_the_exit_code_unknown(self):
+        class Juju(object):
+            def run_local(self, cmd, deadline=None, command=None):
+                # juju leaves a ReturnCode of 0 out
+                return json.dumps([{'MachineId': '0', 'Stdout': 'ok\n'},
+                                   {'MachineId': '1',
+                                    'Error': 'command timed out'}]), ''
+        machines = [JujuCephMachine('ceph/%d' % i, i, '10.0.0.%d' % i,
+                                    'mon-%d' % i) for i in range(2)]
+        with self._session(SyntheticCluster(2, 10).transport()):
+            TroubleshootCeph(['-P', 'juju', '--cache-ttl', '0'])
+            TroubleshootCeph.transport = Juju()
+            results = TroubleshootCeph._execute_juju_batch(machines, 'true')
+        self.assertEqual(results[machines[0]], ('ok\n', '', 0))
+        self.assertEqual(results[machines[1]], ('', 'command timed out',
+                                                None))
+
+    def test_unattended_osd_restart_follows_policy(self):
+        cluster = SyntheticCluster(3, 24, down=[5])
+        args = ['-H', cluster.leader, '-u', 'u', '-p', 'p', '-t', '1',
+                '--unattended', '--deny', 'restart_osds']
+        with self._session(cluster.transport()) as transport:
+            TroubleshootCeph(args)
+            TroubleshootCephOsd(args).troubleshoot_osd()
+            outcome = TroubleshootCeph.outcome.as_dict()
+        self.assertEqual(outcome['result'], 'unresolved')
+        self.assertEqual([(step['action'], step['decision'], step['result'])
+                          for step in outcome['steps']],
+                         [('restart_osds', 'deny', 'skipped')])
+        self.assertFalse([command for host, command in transport.history
+                          if 'ceph-osd@' in command])
+
+    def test_denied_ntp_restart_does_not_end_unattended_run(self):
+        cluster = SyntheticCluster(3, 10, down=[5], clocks={'mon-2': 0.5})
+        with self._session(cluster.transport()):
+            mon = self._mon(cluster, '-t', '1', '-a', '--unattended',
+                            '--allow', 'inject_monmap')
+            mon._troubleshoot_mon_common()
+            outcome = TroubleshootCeph.outcome.as_dict()
+        self.assertEqual([(step['action'], step['decision'], step['result'])
+                          for step in outcome['steps']],
+                         [('restart_ntp', 'deny', 'skipped'),
+                          ('inject_monmap', 'allow', 'unresolved')])
+
+    def test_no_correct_monmap_ends_the_mon_checks(self):
+        cluster = SyntheticCluster(3, 10, down=[5],
+                                   stale=['mon-0', 'mon-1', 'mon-2'])
+        with self._session(cluster.transport()) as transport:
+            mon = self._mon(cluster, '-t', '1', '-a', '--unattended',
+                            '--allow', 'inject_monmap')
+            mon._troubleshoot_mon_common()
+            outcome = TroubleshootCeph.outcome.as_dict()
+        self.assertEqual([(step['action'], step['result'])
+                          for step in outcome['steps']],
+                         [('inject_monmap', 'error')])
+        self.assertFalse([command for host, command in transport.history
+                          if command.startswith('for a in')])
+
+    def test_failed_ntp_restart_is_recorded_as_failed(self):
+        # the synthetic hosts have no ntp service to restart
+        cluster = SyntheticCluster(3, 10, down=[5], clocks={'mon-2': 0.5})
+        with self._session(cluster.transport()):
+            mon = self._mon(cluster, '-t', '1', '--unattended', '--allow',
+                            'restart_ntp')
+            mon._troubleshoot_mon_common()
+            outcome = TroubleshootCeph.outcome.as_dict()
+        self.assertEqual([(step['action'], step['result'], step['status'])
+                          for step in outcome['steps']],
+                         [('restart_ntp', 'failed', 'HEALTH_WARN')])
+
+    def test_step_timeout_bounds_the_osd_restart(self):
+        cluster = SyntheticCluster(3, 24, down=[5])
+        args = ['-H', cluster.leader, '-u', 'u', '-p', 'p', '-t', '30',
+                '--unattended', '--step-timeout', '1']
+        with self._session(cluster.transport()):
+            TroubleshootCeph(args)
+            start = time.time()
+            TroubleshootCephOsd(args).troubleshoot_osd()
+            elapsed = time.time() - start
+            step = TroubleshootCeph.outcome.steps[-1]
+        self.assertEqual((step['action'], step['result'], step['status']),
+                         ('restart_osds', 'timeout', None))
+        self.assertLess(elapsed, 5)
+
+    def test_watch_cycles_only_reprobe_changed_hosts(self):
+        cluster = SyntheticCluster(3, 24, osds_per_host=12)
+        args = ['-H', cluster.leader, '-u', 'u', '-p', 'p']
+        with self._session(cluster.transport()) as transport:
+            TroubleshootCeph(args)
+            watchdog = Watchdog(0, args)
+            watchdog.cycle()
+            calls = transport.calls
+            steady = watchdog.cycle()
+            steady_calls = transport.calls - calls
+            cluster.down = set([3])
+            calls = transport.calls
+            changed = watchdog.cycle()
+            changed_calls = transport.calls - calls
+            osd = TroubleshootCeph.registry.osd_by_id(3)
+        self.assertEqual(steady, [])
+        self.assertEqual(steady_calls, 2)
+        self.assertIn(('osd_down', 3), changed)
+        # the two snapshot commands and a probe of the one osd host
+        self.assertEqual(changed_calls, 3)
+        self.assertEqual(osd.status, 'down')
+
+    def test_watch_survives_the_leader_dropping(self):
+        cluster = SyntheticCluster(3, 24)
+        args = ['-H', cluster.leader, '-u', 'u', '-p', 'p']
+        with self._session(cluster.transport()) as transport:
+            TroubleshootCeph(args)
+            watchdog = Watchdog(0, args)
+            watchdog.cycle()
+            TroubleshootCeph.pool.client(cluster.leader).close()
+            transport.unreachable.add(cluster.leader)
+            down = watchdog.cycle()
+            transport.unreachable.remove(cluster.leader)
+            back = watchdog.cycle()
+        self.assertEqual(down, [('health', 'HEALTH_OK -> None')])
+        self.assertEqual(back, [('health', 'None -> HEALTH_OK')])
+
+    def test_monmap_repair_is_pipelined_per_host(self):
+        stale = ['mon-1', 'mon-2', 'mon-3']
+        cluster = SyntheticCluster(5, 10, stale=stale)
+        with self._session(cluster.transport(
+                [('inject-monmap', 0.3)])) as transport:
+            mon = self._mon(cluster)
+            start = time.time()
+            mon._repair_monmaps()
+            elapsed = time.time() - start
+        self.assertEqual(sorted(cluster.hostnames[host] for host, path
+                                in transport.uploads), stale)
+        self.assertEqual(cluster.stale, set())
+        self.assertLess(elapsed, 0.3 * len(stale))
+
+    def test_failed_inject_over_juju_is_reported(self):
+        cluster = SyntheticCluster(3, 10, stale=['mon-1'])
+        transport = cluster.transport()
+        transport.responders.insert(0, (re.compile('--inject-monmap'),
+                                        ('', 'corrupt monmap', 1)))
+        fd, path = tempfile.mkstemp()
+        os.write(fd, json.dumps(cluster._monmap()))
+        os.close(fd)
+        try:
+            with self._session(transport):
+                TroubleshootCeph(['-P', 'juju', '--cache-ttl', '0'])
+                mon = TroubleshootCephMon(True)
+                machine = [machine for machine
+                           in mon._get_juju_machine_objects()
+                           if machine.mon_id == 'mon-1'][0]
+                with open(path, 'rb') as f:
+                    digest = hashlib.md5(f.read()).hexdigest()
+                result = mon._push_monmap(machine, path, digest)
+        finally:
+            os.remove(path)
+        self.assertEqual(result, ('inject', 'corrupt monmap'))
+        self.assertEqual(cluster.stale, set(['mon-1']))
+
+    def test_monmap_is_pushed_to_an_already_stopped_mon(self):
+        cluster = SyntheticCluster(3, 10, stale=['mon-1'])
+        transport = cluster.transport()
+        # upstart fails to stop a mon that crashed
+        transport.responders[:0] = [
+            (re.compile('stop ceph-mon'), ('', 'Unknown instance', 1)),
+            (re.compile('pidof ceph-mon'), ('', '', 1))]
+        fd, path = tempfile.mkstemp()
+        os.write(fd, json.dumps(cluster._monmap()))
+        os.close(fd)
+        try:
+            with self._session(transport):
+                mon = self._mon(cluster)
+                machine = mon.registry.mon_by_id('mon-1')
+                with open(path, 'rb') as f:
+                    digest = hashlib.md5(f.read()).hexdigest()
+                result = mon._push_monmap(machine, path, digest)
+        finally:
+            os.remove(path)
+        self.assertEqual(result, ('done', None))
+        self.assertEqual(cluster.stale, set())
+
+    def test_clock_skew_is_measured_on_all_mons_at_once(self):
+        cluster = SyntheticCluster(5, 10, clocks={'mon-3': 0.5,
+                                                  'mon-1': -0.01})
+        with self._session(cluster.transport([(r'^date', 0.2)])):
+            mon = self._mon(cluster)
+            start = time.time()
+            skewed = mon._measure_clock_skew()
+            elapsed = time.time() - start
+        self.assertEqual(skewed, ['mon-3'])
+        # one round per sample, every host sampled at once in each
+        samples = ClockProbe(mon).samples
+        self.assertGreaterEqual(elapsed, 0.2 * samples)
+        self.assertLess(elapsed, 0.2 * (samples + 1))
+
+    def test_clock_skew_over_juju_is_measured_on_the_hosts(self):
+        cluster = SyntheticCluster(5, 10, clocks={'mon-3': 0.5,
+                                                  'mon-1': -0.01})
+        # a juju run takes longer than any skew worth finding
+        with self._session(cluster.transport([(r'^juju run', 1)])) \
+                as transport:
+            TroubleshootCeph(['-P', 'juju', '--cache-ttl', '0'])
+            mon = TroubleshootCephMon(True)
+            mon.machines = mon._get_juju_machine_objects()
+            calls = transport.calls
+            skewed = mon._measure_clock_skew()
+            calls = transport.calls - calls
+        self.assertEqual(skewed, ['mon-3'])
+        self.assertEqual(calls, 1)
+
+    def test_mon_reachability_is_one_probe_per_mon(self):
+        cluster = SyntheticCluster(5, 10, cut=['mon-4'])
+        with self._session(cluster.transport(
+                [(r'^for a in', 0.2)])) as transport:
+            mon = self._mon(cluster)
+            calls = transport.calls
+            start = time.time()
+            partitions = mon._check_mon_network()
+            elapsed = time.time() - start
+            calls = transport.calls - calls
+        self.assertEqual(partitions, [set(['mon-0', 'mon-1', 'mon-2',
+                                           'mon-3']), set(['mon-4'])])
+        self.assertEqual(calls, 5)
+        self.assertLess(elapsed, 0.2 * 2)
+
+    def test_juju_gather_is_replayed(self):
+        cluster = SyntheticCluster(5, 10, cut=['mon-4'])
+        with self._session(cluster.transport(
+                [(r'^for a in', 0.2)])) as transport:
+            TroubleshootCeph(['-P', 'juju', '--cache-ttl', '0'])
+            mon = TroubleshootCephMon(True)
+            mon.machines = mon._get_juju_machine_objects()
+            calls = transport.calls
+            start = time.time()
+            partitions = mon._check_mon_network()
+            elapsed = time.time() - start
+            calls = transport.calls - calls
+        self.assertEqual(partitions, [set(['mon-0', 'mon-1', 'mon-2',
+                                           'mon-3']), set(['mon-4'])])
+        # a juju run per mon, all at once
+        self.assertEqual(calls, 5)
+        self.assertLess(elapsed, 0.2 * 2)
+
+    def test_unprobed_mons_are_not_partitioned(self):
+        cluster = SyntheticCluster(3, 10)
+        transport = cluster.transport()
+        transport.responders.insert(0, (re.compile(r'^for a in'),
+                                        ('', 'bash: not found', 127)))
+        with self._session(transport):
+            mon = self._mon(cluster)
+            partitions = mon._check_mon_network()
+        self.assertEqual(partitions, [])
+
+
+class TestReplayTransport(unittest.TestCase):
+    def test_unknown_command_fails(self):
+        client = ReplayTransport([]).connect('10.0.0.1')
+        stdin, stdout, stderr = client.exec_command('uptime')
+        self.assertEqual(stdout.read(), '')
+        self.assertEqual(stdout.channel.recv_exit_status(), 127)
+
+    def test_latency_past_deadline_times_out(self):
+        transport = ReplayTransport([('juju status', '{}')],
+                                    latency=[('juju status', 5)])
+        self.assertRaises(TimeoutError, transport.run_local,
+                          'juju status', Deadline(0.1), 'juju status')
+
+
+class TestLocalStream(unittest.TestCase):
+    def test_closing_reaps_the_process(self):
+        with TroubleshootCeph._open_local('echo \'{"a": 1}\'') as stream:
+            self.assertEqual(stream.read(), '{"a": 1}\n')
+        self.assertTrue(stream.stream.closed)
+
+    def test_juju_error_raises_on_close(self):
+        def read():
+            with TroubleshootCeph._open_local(
+                    'echo ERROR no machines >&2') as stream:
+                stream.read()
+        self.assertRaises(TimeoutError, read)
+
+    def test_deadline_kills_the_process(self):
+        started = time.time()
+
+        def read():
+            with TroubleshootCeph._open_local('sleep 5; echo late',
+                                              Deadline(0.2)) as stream:
+                stream.read()
+        self.assertRaises(TimeoutError, read)
+        self.assertLess(time.time() - started, 2)